@@ -0,0 +1,139 @@
+"""Benchmark database size and message load time with and without
+compressed message content.
+
+Fills two scratch databases with the same sessions, one storing content as
+plain JSON text and one compressed as `SessionService` stores it. Messages
+alternate between short text, tool results holding source files from this
+repository (standing in for long command output) and thinking blocks.
+Reports each database's size and the average time to load and decode one
+session's messages.
+
+Run from apps/backend:
+
+    python -m benchmarks.bench_compression [sessions]
+"""
+
+import glob
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+from utils import database  # noqa: E402
+from utils.compression import compress_content, decode_content  # noqa: E402
+
+MESSAGES_PER_SESSION = 100
+LOOKUPS = 50
+
+SOURCES = [
+    open(path).read()
+    for path in sorted(glob.glob("**/*.py", recursive=True))
+    if os.path.getsize(path) > 0
+]
+WORDS = " ".join(SOURCES).split()
+
+MESSAGES_QUERY = """
+    SELECT id, content FROM messages
+    WHERE session_id = ?
+    ORDER BY created_at ASC, id ASC
+"""
+
+
+def make_content(rng: random.Random, i: int) -> str:
+    if i % 3 == 0:
+        text = " ".join(rng.choices(WORDS, k=rng.randint(5, 40)))
+        content = [{"type": "text", "text": text}]
+    elif i % 3 == 1:
+        output = rng.choice(SOURCES)
+        content = [
+            {
+                "type": "tool_result",
+                "tool_use_id": f"toolu_{uuid.uuid4().hex}",
+                "content": [{"type": "text", "text": output}],
+                "is_error": False,
+            }
+        ]
+    else:
+        thinking = " ".join(rng.choices(WORDS, k=rng.randint(100, 600)))
+        content = [{"type": "thinking", "thinking": thinking}]
+    return json.dumps(content)
+
+
+def fill(path: str, sessions: int, compress: bool) -> list[str]:
+    conn = sqlite3.connect(path)
+    database._create_tables(conn)
+    rng = random.Random(0)
+    start = datetime(2025, 1, 1)
+    session_ids = []
+    for _ in range(sessions):
+        session_id = str(uuid.uuid4())
+        session_ids.append(session_id)
+        conn.execute(
+            "INSERT INTO sessions (id, title, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (session_id, "benchmark", "active", start, start),
+        )
+        rows = []
+        for i in range(MESSAGES_PER_SESSION):
+            content = make_content(rng, i)
+            if compress:
+                content = compress_content(content) or content
+            rows.append(
+                (
+                    str(uuid.uuid4()),
+                    session_id,
+                    "user" if i % 2 else "assistant",
+                    content,
+                    (start + timedelta(seconds=i)).isoformat(),
+                )
+            )
+        conn.executemany(
+            "INSERT INTO messages (id, session_id, role, content, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    conn.execute(
+        "CREATE INDEX idx_messages_session_created_id "
+        "ON messages (session_id, created_at, id)"
+    )
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return session_ids
+
+
+def time_loads(path: str, session_ids: list[str]) -> float:
+    """Average milliseconds to load and decode one session's messages"""
+    conn = sqlite3.connect(path)
+    targets = session_ids[:: max(1, len(session_ids) // LOOKUPS)][:LOOKUPS]
+    start = time.perf_counter()
+    for session_id in targets:
+        for _, content in conn.execute(MESSAGES_QUERY, (session_id,)):
+            json.loads(decode_content(content))
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed * 1000 / len(targets)
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    directory = tempfile.mkdtemp()
+
+    print(f"{'storage':<12} {'size (MiB)':>11} {'load (ms)':>10}")
+    for name, compress in (("plain", False), ("compressed", True)):
+        path = os.path.join(directory, f"{name}.db")
+        session_ids = fill(path, sessions, compress)
+        size = os.path.getsize(path) / 2**20
+        load = time_loads(path, session_ids)
+        print(f"{name:<12} {size:>11.1f} {load:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
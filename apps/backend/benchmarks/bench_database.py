@@ -0,0 +1,117 @@
+"""Micro-benchmark for per-statement vs pooled SQLite connections.
+
+Replays the statements of a typical agent iteration (save a message, load
+the session's messages, read the session) against a scratch database,
+first opening a fresh connection per statement, as the original
+`execute_query` did, then through the pooled, WAL-mode connection from
+`get_db`.
+
+Run from apps/backend:
+
+    python -m benchmarks.bench_database [iterations]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+DATABASE_URL = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+from utils import database  # noqa: E402
+
+SESSION_ID = str(uuid.uuid4())
+CONTENT = '[{"type": "text", "text": "' + "lorem ipsum " * 40 + '"}]'
+
+
+def unpooled_query(query: str, params: tuple = ()) -> list:
+    conn = sqlite3.connect(DATABASE_URL)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        conn.commit()
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def pooled_query(query: str, params: tuple = ()) -> list:
+    with database.get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+
+
+def iteration(query) -> int:
+    """Run one agent iteration's worth of statements; return the count."""
+    query(
+        """
+        INSERT INTO messages (id, session_id, role, content, message, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (
+            str(uuid.uuid4()),
+            SESSION_ID,
+            "assistant",
+            CONTENT,
+            None,
+            datetime.utcnow().isoformat(),
+        ),
+    )
+    query(
+        """
+        SELECT id, session_id, role, content, message, created_at
+        FROM messages
+        WHERE session_id = ?
+        ORDER BY created_at ASC
+        LIMIT 50
+        """,
+        (SESSION_ID,),
+    )
+    query("SELECT * FROM sessions WHERE id = ?", (SESSION_ID,))
+    return 3
+
+
+def run(name: str, query, iterations: int) -> float:
+    statements = 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        statements += iteration(query)
+    elapsed = time.perf_counter() - start
+    qps = statements / elapsed
+    print(f"{name:<12} {statements:>7} queries {elapsed:8.3f}s {qps:10.0f} q/s")
+    return qps
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    # Create the schema without the pooled connection's pragmas, so the
+    # baseline runs on the default rollback journal. WAL is switched on (and
+    # persisted) once the pooled connection is first opened
+    conn = sqlite3.connect(DATABASE_URL)
+    database._create_tables(conn)
+    now = datetime.utcnow()
+    conn.execute(
+        "INSERT INTO sessions (id, title, status, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (SESSION_ID, "benchmark", "active", now, now),
+    )
+    conn.commit()
+    conn.close()
+
+    before = run("per-query", unpooled_query, iterations)
+    after = run("pooled", pooled_query, iterations)
+    print(f"speedup      {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
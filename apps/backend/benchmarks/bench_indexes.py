@@ -0,0 +1,128 @@
+"""Benchmark message and file lookups as the tables grow, with and without
+the indexes added by the schema migrations.
+
+Fills a scratch database in steps up to the target number of message rows
+(spread over sessions of 100 messages, with 2 files each) and times
+loading one session's messages and listing one session's files at every
+step, first on the bare tables, then after running the migrations.
+
+Run from apps/backend:
+
+    python -m benchmarks.bench_indexes [message_rows]
+"""
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+DATABASE_URL = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+from utils import database  # noqa: E402
+from utils.migrations import MIGRATIONS, run_migrations  # noqa: E402
+
+MESSAGES_PER_SESSION = 100
+FILES_PER_SESSION = 2
+STEPS = 5
+LOOKUPS = 50
+
+# The migrations adding the messages and files session indexes
+INDEX_MIGRATIONS = MIGRATIONS[:2]
+
+MESSAGES_QUERY = """
+    SELECT id, session_id, role, content, message, created_at
+    FROM messages
+    WHERE session_id = ?
+    ORDER BY created_at ASC
+"""
+FILES_QUERY = "SELECT * FROM files WHERE session_id = ?"
+
+
+def fill(conn: sqlite3.Connection, sessions: int) -> list[str]:
+    start = datetime(2025, 1, 1)
+    session_ids = []
+    for _ in range(sessions):
+        session_id = str(uuid.uuid4())
+        session_ids.append(session_id)
+        conn.execute(
+            "INSERT INTO sessions (id, title, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (session_id, "benchmark", "active", start, start),
+        )
+        conn.executemany(
+            "INSERT INTO messages (id, session_id, role, content, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    str(uuid.uuid4()),
+                    session_id,
+                    "user",
+                    '[{"type": "text", "text": "hello"}]',
+                    (start + timedelta(seconds=i)).isoformat(),
+                )
+                for i in range(MESSAGES_PER_SESSION)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO files (id, filename, path, size, uploaded_at, "
+            "created_at, session_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (str(uuid.uuid4()), "a.txt", "a.txt", 1, start, start, session_id)
+                for _ in range(FILES_PER_SESSION)
+            ],
+        )
+    conn.commit()
+    return session_ids
+
+
+def time_lookups(
+    conn: sqlite3.Connection, query: str, session_ids: list[str]
+) -> float:
+    """Average milliseconds per lookup over evenly spread sessions"""
+    targets = session_ids[:: max(1, len(session_ids) // LOOKUPS)][:LOOKUPS]
+    start = time.perf_counter()
+    for session_id in targets:
+        conn.execute(query, (session_id,)).fetchall()
+    return (time.perf_counter() - start) * 1000 / len(targets)
+
+
+def main():
+    message_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    sessions_per_step = message_rows // MESSAGES_PER_SESSION // STEPS
+
+    conn = database.connect()
+    database._create_tables(conn)
+
+    print(
+        f"{'messages':>10} {'messages (ms)':>14} {'+index (ms)':>12}"
+        f" {'files (ms)':>11} {'+index (ms)':>12}"
+    )
+    session_ids: list[str] = []
+    for _ in range(STEPS):
+        session_ids += fill(conn, sessions_per_step)
+        rows = len(session_ids) * MESSAGES_PER_SESSION
+
+        conn.execute("DROP INDEX IF EXISTS idx_messages_session_created")
+        conn.execute("DROP INDEX IF EXISTS idx_files_session")
+        conn.execute("DROP TABLE IF EXISTS schema_version")
+        conn.commit()
+        messages_scan = time_lookups(conn, MESSAGES_QUERY, session_ids)
+        files_scan = time_lookups(conn, FILES_QUERY, session_ids)
+
+        run_migrations(conn, INDEX_MIGRATIONS)
+        messages_index = time_lookups(conn, MESSAGES_QUERY, session_ids)
+        files_index = time_lookups(conn, FILES_QUERY, session_ids)
+
+        print(
+            f"{rows:>10} {messages_scan:>14.3f} {messages_index:>12.3f}"
+            f" {files_scan:>11.3f} {files_index:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark full-text session search as the messages table grows.
+
+Fills a scratch database in steps up to the target number of messages,
+written the way `SessionService` saves them (so each is indexed), and
+times `SessionService.search_sessions` for queries of rare, moderately
+common and very common words at every step.
+
+Run from apps/backend:
+
+    python -m benchmarks.bench_search [message_rows]
+"""
+
+import asyncio
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+DATABASE_URL = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["DATABASE_URL"] = DATABASE_URL
+os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+
+from services.session import SessionService  # noqa: E402
+from utils import database  # noqa: E402
+from utils.database import db  # noqa: E402
+
+MESSAGES_PER_SESSION = 100
+STEPS = 5
+LOOKUPS = 20
+
+# Zipf-like vocabulary, so some words are in most messages and some rare
+VOCABULARY = [f"word{i}" for i in range(20_000)]
+CUM_WEIGHTS = list(
+    itertools.accumulate(1 / (i + 1) for i in range(len(VOCABULARY)))
+)
+QUERIES = {
+    "rare": "word15000",
+    "mid": "word300 word40",
+    "common": "word1 word2",
+}
+
+
+def fill(sessions: int, rng: random.Random) -> None:
+    now = datetime(2025, 1, 1)
+    with database.get_db() as conn:
+        for _ in range(sessions):
+            session_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO sessions (id, title, status, created_at, "
+                "updated_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, "benchmark", "active", now, now),
+            )
+            for _ in range(MESSAGES_PER_SESSION):
+                words = rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=30)
+                _, writes = SessionService._message_writes(
+                    session_id, "user", " ".join(words)
+                )
+                for query, params in writes:
+                    conn.execute(query, params)
+        conn.commit()
+
+
+async def time_query(query: str) -> float:
+    """Average milliseconds per search"""
+    start = time.perf_counter()
+    for _ in range(LOOKUPS):
+        await SessionService.search_sessions(query)
+    return (time.perf_counter() - start) * 1000 / LOOKUPS
+
+
+async def main():
+    message_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    sessions_per_step = message_rows // MESSAGES_PER_SESSION // STEPS
+
+    database.init_db()
+    await db.connect()
+    rng = random.Random(0)
+
+    header = "".join(f" {name + ' (ms)':>12}" for name in QUERIES)
+    print(f"{'messages':>10}{header}")
+    for step in range(1, STEPS + 1):
+        fill(sessions_per_step, rng)
+        rows = step * sessions_per_step * MESSAGES_PER_SESSION
+        timings = [await time_query(q) for q in QUERIES.values()]
+        print(f"{rows:>10}" + "".join(f" {t:>12.3f}" for t in timings))
+
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -12,14 +12,47 @@ class Settings(BaseSettings):
     DEBUG: bool = False
 
     DATABASE_URL: str = "computer_use_v2.db"
+    DATABASE_CACHE_SIZE: int = 16 * 1024  # Page cache per connection in KiB
+    DATABASE_READERS: int = 4  # Pooled read connections
+    # Defer chat message writes to a background queue flushed every interval
+    MESSAGE_WRITE_BEHIND: bool = False
+    MESSAGE_FLUSH_INTERVAL: float = 0.05  # seconds
+    # Store message content of at least MIN_SIZE characters zlib-compressed
+    MESSAGE_COMPRESSION: bool = True
+    MESSAGE_COMPRESSION_LEVEL: int = 6
+    MESSAGE_COMPRESSION_MIN_SIZE: int = 512
+    # Rows compressed per transaction by the background recompression job
+    MESSAGE_RECOMPRESS_BATCH: int = 200
+    # Messages queued per WebSocket client before it is dropped as too slow
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT: float = 10.0  # seconds a client may take per message
+    # Recent events kept per session for clients that reconnect, for up to
+    # REPLAY_SESSIONS sessions at a time
+    WS_REPLAY_BUFFER_SIZE: int = 512
+    WS_REPLAY_SESSIONS: int = 256
     ALLOWED_ORIGINS: str = "http://localhost:3000,http://127.0.0.1:3000"
 
     @property
     def cors_origins(self) -> list[str]:
         return [origin.strip() for origin in self.ALLOWED_ORIGINS.split(",")]
 
+    # Sessions idle this many days are moved to archive files (0 disables)
+    ARCHIVE_AFTER_DAYS: int = 30
+    ARCHIVE_DIR: str = "archives"
+    ARCHIVE_INTERVAL: float = 60 * 60  # seconds between archival runs
+    ARCHIVE_IO_RATE: int = 4 * 1024 * 1024  # bytes/second archival limit
+
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 10MB in bytes
     UPLOAD_DIR: str = "uploads"
+    # Thumbnails and text heads of uploads, cached on disk up to CACHE_SIZE
+    PREVIEW_DIR: str = "previews"
+    PREVIEW_CACHE_SIZE: int = 256 * 1024 * 1024  # bytes
+    PREVIEW_IMAGE_SIZE: int = 256  # pixels, longest side of thumbnails
+    PREVIEW_TEXT_BYTES: int = 4 * 1024  # bytes of a text file previewed
+    PREVIEW_ON_UPLOAD: bool = True  # render previews as files are uploaded
+    # Unfinished resumable uploads are discarded after this many seconds
+    # without a chunk
+    UPLOAD_EXPIRE_AFTER: float = 24 * 60 * 60
 
     class Config:
         env_file = ".env"
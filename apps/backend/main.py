@@ -5,10 +5,16 @@ from config import settings
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
-from routers import chat, files, sessions, ws
+from routers import blobs, chat, files, sessions, ws
+from services.archive import ArchiveService
+from services.compression import CompressionService
 from services.file import FileService
-from utils.database import init_db
+from services.session import message_write_queue
+from services.upload import UploadService
+from utils.database import close_db, db, init_db
+from utils.http import RangeStaticFiles
+from utils.middleware import MaxBodySizeMiddleware
+from utils.tasks import start_background_task, stop_background_tasks
 
 logging.basicConfig(
     level=logging.INFO,
@@ -20,8 +26,18 @@ logging.basicConfig(
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    await db.connect()
     FileService.ensure_upload_dir()
+    start_background_task(
+        CompressionService.recompress_messages(), "recompress-messages"
+    )
+    start_background_task(ArchiveService.run(), "archive-sessions")
+    start_background_task(UploadService.run(), "expire-uploads")
     yield
+    await stop_background_tasks()
+    await message_write_queue.flush()
+    await db.close()
+    close_db()
 
 
 app = FastAPI(
@@ -31,7 +47,15 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Configure CORS
+# Reject oversized uploads before they are read; allows for the multipart
+# framing around the file, whose size is checked exactly as it is saved
+app.add_middleware(
+    MaxBodySizeMiddleware,
+    max_size=settings.MAX_UPLOAD_SIZE + 64 * 1024,
+    path_prefix="/files",
+)
+
+# Configure CORS (added last, so it also wraps the responses above)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.cors_origins,
@@ -45,10 +69,13 @@ app.include_router(sessions.router)
 app.include_router(files.router)
 app.include_router(ws.router)
 app.include_router(chat.router)
+app.include_router(blobs.router)
 
-# Mount static files
+# Mount static files, with Range and conditional request support
 app.mount(
-    "/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads"
+    "/uploads",
+    RangeStaticFiles(directory=settings.UPLOAD_DIR),
+    name="uploads",
 )
 
 
@@ -15,6 +15,15 @@ class Session(TimestampedModel):
     status: str = "active"
 
 
+class SessionSummary(Session):
+    message_count: int = 0
+    last_message_at: Optional[datetime] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    stored_bytes: int = 0  # Size of message content as stored
+    archived_at: Optional[datetime] = None  # Set while messages are archived
+
+
 class Message(TimestampedModel):
     id: str
     session_id: str
@@ -25,6 +34,18 @@ class Message(TimestampedModel):
     message: Optional[str] = None  # Optional human-readable message
 
 
+class MessageMatch(BaseModel):
+    message_id: str
+    role: str
+    created_at: datetime
+    snippet: str  # Matching excerpt, with matched words in **bold**
+
+
+class SessionMatch(BaseModel):
+    session: Session
+    messages: List[MessageMatch]  # Best matches first
+
+
 class FileMetadata(TimestampedModel):
     id: str
     filename: str
@@ -33,6 +54,18 @@ class FileMetadata(TimestampedModel):
     size: int
     session_id: Optional[str] = None
     uploaded_at: Optional[datetime] = None
+    sha256: Optional[str] = None  # Hex digest of the file's content
+
+
+class ResumableUpload(TimestampedModel):
+    id: str
+    filename: str
+    mime_type: str
+    size: int
+    session_id: str
+    sha256: Optional[str] = None  # Expected hex digest, checked on completion
+    received: List[List[int]] = []  # Received [start, end) byte ranges
+    received_bytes: int = 0
 
 
 class TaskStep(TimestampedModel):
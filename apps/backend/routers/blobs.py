@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from services.blob import BlobService
+from utils.http import etag_matches, strong_etag
+
+router = APIRouter(prefix="/blobs", tags=["blobs"])
+
+
+@router.get("/{blob_hash}", summary="Get a stored image")
+async def get_blob(blob_hash: str, request: Request):
+    """Get the bytes of a blob referenced from message content.
+
+    Blobs are addressed by the SHA-256 of their content and never change,
+    so responses are cacheable forever.
+
+    Args:
+        blob_hash: The SHA-256 hex digest of the blob
+
+    Returns:
+        Response: The blob's bytes with its media type
+
+    Raises:
+        HTTPException: If blob is not found
+    """
+    etag = strong_etag(blob_hash)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    blob = await BlobService.get_blob(blob_hash)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    media_type, data = blob
+    return Response(content=data, media_type=media_type, headers=headers)
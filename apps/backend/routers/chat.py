@@ -1,9 +1,14 @@
-from typing import List
+import sqlite3
+from datetime import datetime
+from typing import Iterator, List, Optional
 
-from fastapi import APIRouter, HTTPException
+import orjson
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from models.base import Message
 from pydantic import BaseModel, Field
 from services.chat import chat_service
+from utils.compression import decode_content
 
 router = APIRouter(
     prefix="/chat",
@@ -17,6 +22,45 @@ class MessageRequest(BaseModel):
     content: str = Field(description="The message content to send to chat")
 
 
+class MessageResponse(Message):
+    """A message with its content blocks serialized to a JSON string."""
+
+    content: str
+
+
+# Bytes of encoded messages gathered before a chunk is sent
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _encode_messages(rows: list[sqlite3.Row]) -> Iterator[bytes]:
+    """Encode message rows as a JSON array of `MessageResponse` objects.
+
+    The stored content JSON is passed through as the content string,
+    without being parsed, and rows are encoded lazily as chunks are sent.
+    """
+    chunk = [b"["]
+    size = 0
+    for i, row in enumerate(rows):
+        encoded = orjson.dumps(
+            {
+                "created_at": datetime.fromisoformat(row["created_at"]),
+                "updated_at": None,
+                "id": row["id"],
+                "session_id": row["session_id"],
+                "role": row["role"],
+                "content": decode_content(row["content"]),
+                "message": None,
+            }
+        )
+        chunk.append(b"," + encoded if i else encoded)
+        size += len(encoded)
+        if size >= STREAM_CHUNK_SIZE:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    chunk.append(b"]")
+    yield b"".join(chunk)
+
+
 @router.post(
     "/{session_id}/messages",
     summary="Create a new message",
@@ -42,24 +86,46 @@ async def create_message(session_id: str, request: MessageRequest):
 
 @router.get(
     "/{session_id}/messages",
-    response_model=List[Message],
+    response_model=List[MessageResponse],
     summary="Get session messages",
 )
-async def get_session_messages(session_id: str):
-    """Get all messages in a conversation session.
+async def get_session_messages(
+    session_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+):
+    """Get messages in a conversation session, optionally a page at a time.
+
+    Message IDs act as cursors. Pass `limit` to get the latest messages,
+    then the first message's ID as `before` to page back through history.
+    Pass the last message seen as `after` to fetch only newer messages. The
+    `X-Has-More` header tells whether the page was cut short by `limit`.
+
+    The response is streamed, with each message's stored content JSON
+    passed through unchanged as its content string.
 
     Args:
         session_id: The ID of the session
+        limit: Maximum number of messages to return
+        before: Only return messages before this message ID
+        after: Only return messages after this message ID
 
     Returns:
-        List[Message]: List of messages in chronological order, with content formatted for frontend
-    """
-    import json
-
-    messages = await chat_service.get_session_messages(session_id)
+        List[MessageResponse]: List of messages in chronological order, with content formatted for frontend
 
-    # Convert content blocks to string for frontend
-    for msg in messages:
-        msg.content = json.dumps(msg.content)
-
-    return messages
+    Raises:
+        HTTPException: If a cursor is not a message in the session
+    """
+    page = await chat_service.get_session_message_rows(
+        session_id, limit=limit, before=before, after=after
+    )
+    if page is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    rows, has_more = page
+
+    return StreamingResponse(
+        _encode_messages(rows),
+        media_type="application/json",
+        headers={"X-Has-More": "true" if has_more else "false"},
+    )
@@ -1,14 +1,53 @@
 import os
-from typing import List
+import re
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, UploadFile
-from fastapi.responses import FileResponse
-from models.base import FileMetadata
-from services.file import UPLOAD_DIR, FileService
+from config import settings
+from fastapi import APIRouter, Header, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from models.base import FileMetadata, ResumableUpload
+from pydantic import BaseModel, Field
+from services.file import UPLOAD_DIR, FileService, UploadTooLargeError
+from services.preview import PreviewService
+from services.session import SessionService
+from services.upload import (
+    ChecksumMismatchError,
+    UploadBusyError,
+    UploadIncompleteError,
+    UploadRangeError,
+    UploadService,
+)
+from utils.http import send_file, strong_etag
+from utils.tasks import start_background_task
+from utils.zipstream import ZipEntry, safe_name, stream_zip, unique_names
+
+
+class UploadCreate(BaseModel):
+    filename: str
+    size: int = Field(ge=0)
+    session_id: str
+    mime_type: Optional[str] = None
+    sha256: Optional[str] = Field(None, regex="^[0-9a-fA-F]{64}$")
+
+
+class UploadComplete(BaseModel):
+    sha256: Optional[str] = Field(None, regex="^[0-9a-fA-F]{64}$")
+
+
+# Content-Range of a chunk: "bytes <first>-<last>/<total or *>"
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
 
 router = APIRouter(prefix="/files", tags=["files"])
 
 
+def _start_preview(file: FileMetadata) -> None:
+    """Render a new file's preview in the background, if enabled"""
+    if settings.PREVIEW_ON_UPLOAD:
+        start_background_task(
+            PreviewService.get_preview(file), f"preview-{file.id}"
+        )
+
+
 @router.post("", response_model=FileMetadata, summary="Upload a new file")
 async def upload_file(file: UploadFile, session_id: str):
     """Upload a new file and associate it with a session.
@@ -21,13 +60,186 @@ async def upload_file(file: UploadFile, session_id: str):
         FileMetadata: The uploaded file's metadata
 
     Raises:
-        HTTPException: If no session_id is provided
+        HTTPException: If no session_id is provided, or the file is larger
+            than MAX_UPLOAD_SIZE
     """
     if not session_id:
         raise HTTPException(
             status_code=400, detail="A session ID is required to upload files"
         )
-    return await FileService.save_file(file, session_id)
+    try:
+        saved = await FileService.save_file(file, session_id)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    _start_preview(saved)
+    return saved
+
+
+@router.post(
+    "/uploads",
+    response_model=ResumableUpload,
+    summary="Start a resumable upload",
+)
+async def create_upload(data: UploadCreate):
+    """Start a resumable upload, to be sent in chunks with PUT.
+
+    Args:
+        data: The file's name, size and session, and optionally its content
+            type and expected SHA-256
+
+    Returns:
+        ResumableUpload: The new upload
+
+    Raises:
+        HTTPException: If the session is not found, or the file is larger
+            than MAX_UPLOAD_SIZE
+    """
+    if not await SessionService.get_session(data.session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        return await UploadService.create_upload(
+            data.filename,
+            data.size,
+            data.session_id,
+            data.mime_type,
+            data.sha256,
+        )
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+@router.get(
+    "/uploads/{upload_id}",
+    response_model=ResumableUpload,
+    summary="Get resumable upload progress",
+)
+async def get_upload(upload_id: str):
+    """Get an upload and the byte ranges it has received.
+
+    Args:
+        upload_id: The ID of the upload
+
+    Returns:
+        ResumableUpload: The upload, with its received ranges
+
+    Raises:
+        HTTPException: If the upload is not found
+    """
+    upload = await UploadService.get_upload(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+@router.put(
+    "/uploads/{upload_id}",
+    response_model=ResumableUpload,
+    summary="Send a chunk of a resumable upload",
+)
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    content_range: str = Header(...),
+):
+    """Write a chunk of an upload at the offset given by its Content-Range.
+
+    The body is the raw bytes of the chunk, e.g. with
+    `Content-Range: bytes 0-1048575/5242880` for the first MiB of a 5 MiB
+    file. Chunks can be sent in any order, and sent again after a failure.
+
+    Args:
+        upload_id: The ID of the upload
+        content_range: The chunk's byte range within the file
+
+    Returns:
+        ResumableUpload: The upload, with its received ranges
+
+    Raises:
+        HTTPException: If the upload is not found, the range is malformed or
+            doesn't match the body, or the upload is being completed
+    """
+    match = CONTENT_RANGE.fullmatch(content_range.strip())
+    if not match:
+        raise HTTPException(status_code=400, detail="Invalid Content-Range")
+    first, last, total = match.groups()
+    upload = await UploadService.get_upload(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    if total != "*" and int(total) != upload.size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Content-Range total must be {upload.size}",
+        )
+
+    try:
+        upload = await UploadService.write_range(
+            upload_id, int(first), int(last) + 1, request.stream()
+        )
+    except UploadRangeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except UploadBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+@router.post(
+    "/uploads/{upload_id}/complete",
+    response_model=FileMetadata,
+    summary="Complete a resumable upload",
+)
+async def complete_upload(
+    upload_id: str, data: Optional[UploadComplete] = None
+):
+    """Verify a fully received upload and save it as a file.
+
+    Args:
+        upload_id: The ID of the upload
+        data: Optionally the file's expected SHA-256, overriding any given
+            when the upload was started
+
+    Returns:
+        FileMetadata: The uploaded file's metadata
+
+    Raises:
+        HTTPException: If the upload is not found, is missing bytes, doesn't
+            match its checksum, or is already being completed
+    """
+    try:
+        file = await UploadService.complete_upload(
+            upload_id, data.sha256 if data else None
+        )
+    except (UploadIncompleteError, UploadBusyError) as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ChecksumMismatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not file:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    _start_preview(file)
+    return file
+
+
+@router.delete("/uploads/{upload_id}", summary="Cancel a resumable upload")
+async def cancel_upload(upload_id: str):
+    """Cancel an upload and discard what it has received.
+
+    Args:
+        upload_id: The ID of the upload
+
+    Returns:
+        dict: Success status
+
+    Raises:
+        HTTPException: If the upload is not found or is being completed
+    """
+    try:
+        cancelled = await UploadService.cancel_upload(upload_id)
+    except UploadBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not cancelled:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"status": "success"}
 
 
 @router.get(
@@ -44,7 +256,54 @@ async def list_files(session_id: str):
     Returns:
         List[FileMetadata]: List of file metadata
     """
-    return FileService.list_files(session_id)
+    return await FileService.list_files(session_id)
+
+
+@router.get("/archive", summary="Download all session files as a zip")
+async def download_archive(session_id: str, compress: bool = True):
+    """Download every file of a session as one zip archive.
+
+    The archive is built as it is sent, reading each file lazily, so it is
+    never staged on disk or in memory whatever its size. Entries are named
+    after just the last component of each file's name, so none can unzip
+    outside the target directory, and files with the same name are
+    numbered, as in "report (2).pdf".
+
+    Args:
+        session_id: The session whose files to download
+        compress: Deflate the files; pass false to store them as they are,
+            which is faster for files that are already compressed
+
+    Returns:
+        StreamingResponse: The zip archive
+
+    Raises:
+        HTTPException: If the session is not found
+    """
+    if not await SessionService.get_session(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    files = await FileService.list_files(session_id)
+    files.sort(key=lambda file: file.uploaded_at or file.created_at)
+    entries = [
+        ZipEntry(
+            name,
+            os.path.join(UPLOAD_DIR, file.path),
+            file.uploaded_at or file.created_at,
+        )
+        for file, name in zip(
+            files, unique_names(safe_name(file.filename) for file in files)
+        )
+    ]
+    return StreamingResponse(
+        stream_zip(entries, compress),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": (
+                f'attachment; filename="session-{session_id}.zip"'
+            )
+        },
+    )
 
 
 @router.get(
@@ -62,36 +321,81 @@ async def get_file_info(file_id: str):
     Raises:
         HTTPException: If file is not found
     """
-    file = FileService.get_file(file_id)
+    file = await FileService.get_file(file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     return file
 
 
 @router.get("/{file_id}/download", summary="Download a file")
-async def download_file(file_id: str):
+async def download_file(file_id: str, request: Request):
     """Download a specific file.
 
+    Supports Range requests for partial and resumed downloads, and answers
+    If-None-Match with a 304 using an ETag derived from the file's SHA-256.
+
     Args:
         file_id: The ID of the file to download
 
     Returns:
-        FileResponse: The file content with proper headers
+        Response: The file content with proper headers, part of it, or a
+            304 if the client's copy is current
 
     Raises:
         HTTPException: If file is not found
     """
-    file = FileService.get_file(file_id)
+    file = await FileService.get_file(file_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
 
-    file_path = os.path.join(UPLOAD_DIR, file.path)
-    if not os.path.exists(file_path):
+    response = await send_file(
+        request,
+        os.path.join(UPLOAD_DIR, file.path),
+        etag=strong_etag(file.sha256) if file.sha256 else None,
+        media_type=file.mime_type,
+        filename=file.filename,
+        cache_control="private, no-cache",
+    )
+    if response is None:
         raise HTTPException(status_code=404, detail="File not found on disk")
+    return response
 
-    return FileResponse(
-        file_path, filename=file.filename, media_type=file.mime_type
+
+@router.get("/{file_id}/preview", summary="Get a file preview")
+async def get_file_preview(file_id: str, request: Request):
+    """Get a small preview of a file.
+
+    Images get a WebP thumbnail and text files their first lines as plain
+    text. Previews are rendered on upload or first request, then cached,
+    and responses can be cached by the client indefinitely.
+
+    Args:
+        file_id: The ID of the file
+
+    Returns:
+        Response: The preview, or a 304 if the client's copy is current
+
+    Raises:
+        HTTPException: If the file is not found or has no preview
+    """
+    file = await FileService.get_file(file_id)
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    preview = await PreviewService.get_preview(file)
+    if preview is None:
+        raise HTTPException(status_code=404, detail="No preview available")
+    path, media_type = preview
+    response = await send_file(
+        request,
+        path,
+        etag=strong_etag(os.path.splitext(os.path.basename(path))[0]),
+        media_type=media_type,
+        cache_control="private, max-age=31536000, immutable",
     )
+    if response is None:
+        # Evicted while it was being served
+        raise HTTPException(status_code=404, detail="No preview available")
+    return response
 
 
 @router.delete("/{file_id}", summary="Delete a file")
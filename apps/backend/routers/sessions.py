@@ -1,7 +1,7 @@
-from typing import List
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, HTTPException
-from models.base import Session
+from fastapi import APIRouter, HTTPException, Query, Response
+from models.base import Session, SessionMatch, SessionSummary
 from pydantic import BaseModel
 from services.session import SessionService
 
@@ -23,17 +23,71 @@ async def create_session(data: SessionCreate):
     Returns:
         Session: The created session object
     """
-    return SessionService.create_session(data.title)
+    return await SessionService.create_session(data.title)
 
 
-@router.get("", response_model=List[Session], summary="List all sessions")
-async def list_sessions():
-    """Get a list of all sessions.
+@router.get(
+    "", response_model=List[SessionSummary], summary="List sessions"
+)
+async def list_sessions(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    before: Optional[str] = None,
+    sort: Literal["activity", "created"] = "activity",
+    status: Optional[str] = None,
+):
+    """Get sessions with their message counts, activity and usage.
+
+    Sessions are listed newest first, by last activity or creation time.
+    Pass `limit` to get a page, then the last session's ID as `before` to
+    get the next one. The `X-Has-More` header tells whether the page was
+    cut short by `limit`.
+
+    Args:
+        limit: Maximum number of sessions to return
+        before: Only return sessions listed after this session ID
+        sort: "activity" to order by last message, "created" by creation
+        status: Only return sessions with this status
+
+    Returns:
+        List[SessionSummary]: The sessions in the requested order
+
+    Raises:
+        HTTPException: If the cursor is not a session
+    """
+    page = await SessionService.list_sessions(
+        limit=limit, before=before, sort=sort, status=status
+    )
+    if page is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    sessions, has_more = page
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return sessions
+
+
+@router.get(
+    "/search",
+    response_model=List[SessionMatch],
+    summary="Search sessions by message text",
+)
+async def search_sessions(
+    q: str = Query(..., min_length=1, max_length=500),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """Find sessions by what was said or typed in them.
+
+    Searches message text, tool inputs and tool output. Every word of the
+    query must appear in a message.
+
+    Args:
+        q: The words to search for
+        limit: Maximum number of sessions to return
 
     Returns:
-        List[Session]: List of all sessions
+        List[SessionMatch]: Matching sessions, best first, each with
+            snippets of its best matching messages
     """
-    return SessionService.list_sessions()
+    return await SessionService.search_sessions(q, limit=limit)
 
 
 @router.get(
@@ -51,7 +105,7 @@ async def get_session(session_id: str):
     Raises:
         HTTPException: If session is not found
     """
-    session = SessionService.get_session(session_id)
+    session = await SessionService.get_session(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
@@ -76,7 +130,7 @@ async def update_session(
     Raises:
         HTTPException: If session is not found
     """
-    session = SessionService.update_session(session_id, title, status)
+    session = await SessionService.update_session(session_id, title, status)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     return session
@@ -95,6 +149,6 @@ async def delete_session(session_id: str):
     Raises:
         HTTPException: If session is not found
     """
-    if not SessionService.delete_session(session_id):
+    if not await SessionService.delete_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     return {"status": "success"}
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from services.ws import ws_manager
 
@@ -5,7 +7,9 @@ router = APIRouter(prefix="/ws", tags=["websocket"])
 
 
 @router.websocket("/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
+async def websocket_endpoint(
+    websocket: WebSocket, session_id: str, last_seq: Optional[int] = None
+):
     """WebSocket endpoint for receiving real-time updates.
 
     Clients will receive updates for:
@@ -14,14 +18,22 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
     - Claude messages
     - Session updates
 
+    Every event carries a `seq` number. A client reconnecting with
+    `?last_seq=` is first sent the events it missed, if they are still
+    buffered, followed by `{"type": "sync", "seq": ...}`. Otherwise it gets
+    `{"type": "resync", "seq": ...}` and should refetch the messages.
+
     Args:
         websocket: The WebSocket connection
         session_id: The ID of the session to subscribe to
+        last_seq: The `seq` of the last event received before reconnecting
     """
-    await ws_manager.connect(websocket, session_id)
+    await ws_manager.connect(websocket, session_id, last_seq)
     try:
         while True:
             # Wait for messages
             await websocket.receive_text()
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager.disconnect(websocket, session_id)
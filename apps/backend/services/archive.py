@@ -0,0 +1,287 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from config import settings
+from services.blob import BlobService
+from services.session import SessionService
+from utils.archive import archive_path, read_archive, write_archive
+from utils.blobs import blob_hashes
+from utils.compression import decode_content
+from utils.database import Write, db
+
+logger = logging.getLogger(__name__)
+
+# Sessions looked up per query by the archival job
+_ARCHIVE_BATCH = 50
+
+
+class ArchiveService:
+    """Moves the messages of idle sessions to per-session archive files.
+
+    An archived session keeps its row, summary columns included, with
+    `archived_at` set, while its messages live in the archive file until
+    the session is opened again. Archived messages are not searchable.
+    """
+
+    # Serializes archiving and restoring, so a session is never archived
+    # or restored twice at once
+    _lock = asyncio.Lock()
+
+    @staticmethod
+    async def run(interval: float = settings.ARCHIVE_INTERVAL) -> None:
+        """Archive idle sessions every `interval` seconds, until cancelled"""
+        if settings.ARCHIVE_AFTER_DAYS <= 0:
+            return
+        while True:
+            try:
+                await ArchiveService.archive_idle_sessions()
+            except Exception:
+                logger.exception("Failed to archive idle sessions")
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    async def archive_idle_sessions(
+        idle_days: int = settings.ARCHIVE_AFTER_DAYS,
+        io_rate: int = settings.ARCHIVE_IO_RATE,
+    ) -> int:
+        """Archive every session with no activity in the last `idle_days`.
+
+        After each session the job sleeps long enough to keep the bytes it
+        reads and writes under `io_rate` per second on average.
+
+        Args:
+            idle_days: Days without activity before a session is archived
+            io_rate: Bytes per second the job may read and write
+
+        Returns:
+            int: The number of sessions archived
+        """
+        cutoff = (datetime.utcnow() - timedelta(days=idle_days)).isoformat()
+        archived = 0
+        # Keyset cursor over (last_active_at, id), so sessions sharing a
+        # last_active_at across a batch boundary aren't skipped
+        last_active_at, last_id = "", ""
+        while True:
+            rows = await db.fetch_all(
+                """
+                SELECT id, last_active_at, restored_at, stored_bytes
+                FROM sessions
+                WHERE archived_at IS NULL
+                    AND (last_active_at, id) > (?, ?)
+                    AND last_active_at < ?
+                    AND (restored_at IS NULL OR restored_at < ?)
+                    AND message_count > 0
+                ORDER BY last_active_at, id
+                LIMIT ?
+                """,
+                (last_active_at, last_id, cutoff, cutoff, _ARCHIVE_BATCH),
+            )
+            if not rows:
+                break
+            last_active_at, last_id = (
+                rows[-1]["last_active_at"],
+                rows[-1]["id"],
+            )
+
+            for row in rows:
+                size = await ArchiveService.archive_session(
+                    row["id"], row["last_active_at"], row["restored_at"]
+                )
+                if size is None:
+                    continue
+                archived += 1
+                await asyncio.sleep((size + row["stored_bytes"]) / io_rate)
+
+        if archived:
+            logger.info(f"Archived {archived} idle sessions")
+        return archived
+
+    @staticmethod
+    async def archive_session(
+        session_id: str,
+        last_active_at: str,
+        restored_at: str | None = None,
+    ) -> int | None:
+        """Move a session's messages to its archive file.
+
+        The session is only archived if it is still not archived, has had
+        no activity since `last_active_at` once the archive is written, and
+        hasn't been restored since `restored_at`.
+
+        Args:
+            session_id: The ID of the session
+            last_active_at: The session's last activity time, as stored
+            restored_at: When the session was last restored, as stored
+
+        Returns:
+            int: The size of the archive file, or None if the session
+                was not archived
+        """
+        async with ArchiveService._lock:
+            session = await db.fetch_one(
+                """
+                SELECT last_active_at, archived_at, restored_at
+                FROM sessions WHERE id = ?
+                """,
+                (session_id,),
+            )
+            if (
+                session is None
+                or session["archived_at"] is not None
+                or session["last_active_at"] != last_active_at
+                or session["restored_at"] != restored_at
+            ):
+                return None
+            return await ArchiveService._archive_session(
+                session_id, last_active_at
+            )
+
+    @staticmethod
+    async def _archive_session(
+        session_id: str, last_active_at: str
+    ) -> int | None:
+        rows = await db.fetch_all(
+            """
+            SELECT id, role, content, message, created_at
+            FROM messages
+            WHERE session_id = ?
+            ORDER BY created_at ASC, id ASC
+            """,
+            (session_id,),
+        )
+        messages = [
+            {
+                "type": "message",
+                "id": row["id"],
+                "role": row["role"],
+                "content": json.loads(decode_content(row["content"])),
+                "message": row["message"],
+                "created_at": row["created_at"],
+            }
+            for row in rows
+        ]
+        hashes = set().union(*(blob_hashes(m["content"]) for m in messages))
+        blobs = await BlobService.get_blobs(list(hashes))
+
+        archived_at = datetime.utcnow()
+        records = [
+            {
+                "type": "session",
+                "id": session_id,
+                "archived_at": archived_at.isoformat(),
+            },
+            *messages,
+            *(
+                {
+                    "type": "blob",
+                    "hash": digest,
+                    "media_type": media_type,
+                    "data": base64.b64encode(data).decode(),
+                }
+                for digest, (media_type, data) in blobs.items()
+            ),
+        ]
+        path = archive_path(session_id)
+        size = await asyncio.to_thread(write_archive, path, records)
+
+        async with db.transaction() as conn:
+            # A message may have been saved while the archive was written
+            async with conn.execute(
+                "SELECT last_active_at FROM sessions WHERE id = ?",
+                (session_id,),
+            ) as cursor:
+                session = await cursor.fetchone()
+            if session is None or session["last_active_at"] != last_active_at:
+                await asyncio.to_thread(os.remove, path)
+                return None
+            await conn.execute(
+                "DELETE FROM messages WHERE session_id = ?", (session_id,)
+            )
+            await conn.execute(
+                "UPDATE sessions SET archived_at = ? WHERE id = ?",
+                (archived_at, session_id),
+            )
+
+        # The archive holds its own copy of the images
+        await BlobService.delete_orphans(list(hashes))
+        return size
+
+    @staticmethod
+    async def restore_session(session_id: str) -> bool:
+        """Move an archived session's messages back into the database.
+
+        Args:
+            session_id: The ID of the session
+
+        Returns:
+            bool: True if the session was archived and has been restored
+        """
+        row = await db.fetch_one(
+            "SELECT archived_at FROM sessions WHERE id = ?", (session_id,)
+        )
+        if row is None or row["archived_at"] is None:
+            return False
+
+        async with ArchiveService._lock:
+            # Another request may have restored it while this one waited
+            row = await db.fetch_one(
+                "SELECT archived_at FROM sessions WHERE id = ?", (session_id,)
+            )
+            if row is None or row["archived_at"] is None:
+                return False
+
+            path = archive_path(session_id)
+            records = await asyncio.to_thread(lambda: list(read_archive(path)))
+
+            writes: list[Write] = []
+            now = datetime.utcnow()
+            for record in records:
+                if record["type"] == "blob":
+                    data = base64.b64decode(record["data"])
+                    writes.append(
+                        (
+                            """
+                            INSERT OR IGNORE INTO blobs
+                                (hash, media_type, size, data, created_at)
+                            VALUES (?, ?, ?, ?, ?)
+                            """,
+                            (
+                                record["hash"],
+                                record["media_type"],
+                                len(data),
+                                data,
+                                now,
+                            ),
+                        )
+                    )
+                elif record["type"] == "message":
+                    insert_writes, _ = SessionService._insert_message_writes(
+                        record["id"],
+                        session_id,
+                        record["role"],
+                        record["content"],
+                        record["message"],
+                        record["created_at"],
+                    )
+                    writes.extend(insert_writes)
+
+            async with db.transaction() as conn:
+                for query, params in writes:
+                    await conn.execute(query, params)
+                # Keeps the session from being archived again until it has
+                # been idle for ARCHIVE_AFTER_DAYS since it was restored
+                await conn.execute(
+                    """
+                    UPDATE sessions SET archived_at = NULL, restored_at = ?
+                    WHERE id = ?
+                    """,
+                    (now.isoformat(), session_id),
+                )
+            await asyncio.to_thread(os.remove, path)
+
+        logger.info(f"Restored archived session {session_id}")
+        return True
@@ -0,0 +1,99 @@
+from datetime import datetime
+from typing import Any, Optional
+
+from utils.blobs import blob_hashes, extract_blobs, inline_blobs
+from utils.database import Write, db
+
+# Keeps IN (...) lists under SQLite's bound parameter limit
+_FETCH_BATCH = 500
+
+
+class BlobService:
+    @staticmethod
+    def extract(
+        content: list[dict[str, Any]],
+    ) -> tuple[list[dict[str, Any]], list[Write]]:
+        """Move inline images in `content` to the blob store.
+
+        Returns the content with blob references in place of the images,
+        and the writes that store the images. Images already in the store
+        are not written again.
+        """
+        content, blobs = extract_blobs(content)
+        now = datetime.utcnow()
+        writes = [
+            (
+                """
+                INSERT OR IGNORE INTO blobs (hash, media_type, size, data, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (digest, media_type, len(data), data, now),
+            )
+            for digest, (media_type, data) in blobs.items()
+        ]
+        return content, writes
+
+    @staticmethod
+    async def get_blob(blob_hash: str) -> Optional[tuple[str, bytes]]:
+        """Get a blob's media type and data by hash"""
+        row = await db.fetch_one(
+            "SELECT media_type, data FROM blobs WHERE hash = ?", (blob_hash,)
+        )
+        if not row:
+            return None
+        return row["media_type"], row["data"]
+
+    @staticmethod
+    async def get_blobs(hashes: list[str]) -> dict[str, tuple[str, bytes]]:
+        """Get the media type and data of each blob found, by hash"""
+        blobs: dict[str, tuple[str, bytes]] = {}
+        for i in range(0, len(hashes), _FETCH_BATCH):
+            batch = hashes[i : i + _FETCH_BATCH]
+            rows = await db.fetch_all(
+                f"""
+                SELECT hash, media_type, data FROM blobs
+                WHERE hash IN ({", ".join("?" * len(batch))})
+                """,
+                batch,
+            )
+            blobs.update(
+                (row["hash"], (row["media_type"], row["data"]))
+                for row in rows
+            )
+        return blobs
+
+    @staticmethod
+    async def rehydrate(
+        contents: list[list[dict[str, Any]]],
+    ) -> list[list[dict[str, Any]]]:
+        """Inline the images referenced by each message content, for the API"""
+        hashes = list(set().union(*(blob_hashes(c) for c in contents)))
+        if not hashes:
+            return contents
+
+        blobs = await BlobService.get_blobs(hashes)
+        data = {digest: blob for digest, (_, blob) in blobs.items()}
+        return [inline_blobs(content, data) for content in contents]
+
+    @staticmethod
+    async def delete_orphans(hashes: list[str]) -> int:
+        """Delete the blobs among `hashes` that no message references.
+
+        Returns:
+            int: The number of blobs deleted
+        """
+        deleted = 0
+        for i in range(0, len(hashes), _FETCH_BATCH):
+            batch = hashes[i : i + _FETCH_BATCH]
+            deleted += await db.execute(
+                f"""
+                DELETE FROM blobs
+                WHERE hash IN ({", ".join("?" * len(batch))})
+                    AND NOT EXISTS (
+                        SELECT 1 FROM message_blobs
+                        WHERE message_blobs.hash = blobs.hash
+                    )
+                """,
+                batch,
+            )
+        return deleted
@@ -1,6 +1,7 @@
 import json
 import logging
 import platform
+import sqlite3
 import uuid
 from datetime import datetime
 from typing import Any, List, cast
@@ -18,9 +19,12 @@ from anthropic.types.beta import (
 )
 from fastapi import HTTPException
 from models.base import Message
+from services.archive import ArchiveService
+from services.blob import BlobService
 from services.session import SessionService
 from services.ws import ws_manager
-from utils.database import execute_query
+from utils.compression import decode_content
+from utils.database import db
 
 from .tools import TOOL_GROUPS_BY_VERSION, ToolCollection, ToolResult
 
@@ -42,6 +46,7 @@ class ChatService:
       Firefox. Firefox should be your default browser.
     * Using bash tool you can start GUI applications, but you need to set export DISPLAY=:1 and use a subshell. For example "(DISPLAY=:1 xterm &)". GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear.
     * When using your bash tool with commands that are expected to output very large quantities of text, redirect into a tmp file and use str_replace_editor or `grep -n -B <lines before> -A <lines after> <query> <filename>` to confirm output.
+    * To make several replacements in one file, call str_replace_editor with command "multi_edit" and an `edits` list of {{"old_str": ..., "new_str": ...}} objects instead of issuing several `str_replace` calls. The edits are applied in order and written together; if any of them fails, none are applied.
     * When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
     * When using your computer function calls, they take a while to run and send
       back to you.  Where possible/feasible, try to chain multiple of these
@@ -83,78 +88,101 @@ class ChatService:
         userMessage: str,
     ) -> Message:
         try:
-            # Save user message to database - for user messages, convert to content block array
-            user_content = [{"type": "text", "text": userMessage}]
-            SessionService.save_message(
-                session_id=session_id,
-                role="user",
-                content=user_content,
-                message=userMessage,
-            )
-
-            iterations = 0
-            while True and iterations < self.MAX_ITERATIONS:
-                iterations += 1
-                # Get all messages for this session
-                messages = SessionService.get_session_messages(session_id)
-
-                # Convert to Anthropic format
-                anthropic_messages: list[BetaMessageParam] = [
-                    {"role": msg.role, "content": msg.content}
-                    for msg in messages
-                ]
-                raw_response = (
-                    self.client.beta.messages.with_raw_response.create(
-                        model=self.ANTHROPIC_MODEL,
-                        max_tokens=self.MAX_TOKENS,
-                        system=self.SYSTEM_PROMPT,
-                        tools=self.tool_collection.to_params(),
-                        messages=anthropic_messages,
-                        betas=["computer-use-2025-01-24"],
-                    )
-                )
+            await ArchiveService.restore_session(session_id)
 
-                response = raw_response.parse()
-                response_params = self._response_to_params(response)
-
-                # Save assistant response to database
-                SessionService.save_message(
+            # Load the conversation once and keep it up to date in memory
+            messages = await SessionService.get_session_messages(session_id)
+            contents = await BlobService.rehydrate(
+                [msg.content for msg in messages]
+            )
+            anthropic_messages: list[BetaMessageParam] = [
+                {"role": msg.role, "content": content}
+                for msg, content in zip(messages, contents)
+            ]
+
+            # Each iteration's messages are written in a single transaction,
+            # so an assistant's tool uses are never saved without their
+            # results
+            async with SessionService.unit_of_work() as uow:
+                # Save user message to database - for user messages, convert to content block array
+                user_content = [{"type": "text", "text": userMessage}]
+                uow.save_message(
                     session_id=session_id,
-                    role="assistant",
-                    content=response_params,
+                    role="user",
+                    content=user_content,
+                    message=userMessage,
+                )
+                anthropic_messages.append(
+                    {"role": "user", "content": user_content}
                 )
+                await uow.commit()
+
+                iterations = 0
+                while True and iterations < self.MAX_ITERATIONS:
+                    iterations += 1
+                    raw_response = (
+                        self.client.beta.messages.with_raw_response.create(
+                            model=self.ANTHROPIC_MODEL,
+                            max_tokens=self.MAX_TOKENS,
+                            system=self.SYSTEM_PROMPT,
+                            tools=self.tool_collection.to_params(),
+                            messages=anthropic_messages,
+                            betas=["computer-use-2025-01-24"],
+                        )
+                    )
 
-                tool_result_contents: list[BetaToolResultBlockParam] = []
-                for content_block in response_params:
-                    await self._handle_output(
-                        session_id,
-                        content_block,
+                    response = raw_response.parse()
+                    response_params = self._response_to_params(response)
+
+                    # Save assistant response to database
+                    uow.save_message(
+                        session_id=session_id,
+                        role="assistant",
+                        content=response_params,
+                        input_tokens=response.usage.input_tokens,
+                        output_tokens=response.usage.output_tokens,
+                    )
+                    anthropic_messages.append(
+                        {"role": "assistant", "content": response_params}
                     )
 
-                    if content_block["type"] == "tool_use":
-                        result = await self.tool_collection.run(
-                            name=content_block["name"],
-                            tool_input=cast(
-                                dict[str, Any], content_block["input"]
-                            ),
+                    # Broadcast once the iteration is committed, so clients
+                    # are never shown messages that weren't saved
+                    outputs: list[BetaContentBlockParam] = []
+                    tool_result_contents: list[BetaToolResultBlockParam] = []
+                    for content_block in response_params:
+                        outputs.append(content_block)
+
+                        if content_block["type"] == "tool_use":
+                            result = await self.tool_collection.run(
+                                name=content_block["name"],
+                                tool_input=cast(
+                                    dict[str, Any], content_block["input"]
+                                ),
+                            )
+                            tool_result_content = self._make_api_tool_result(
+                                result, content_block["id"]
+                            )
+                            outputs.append(tool_result_content)
+                            tool_result_contents.append(tool_result_content)
+
+                    if tool_result_contents:
+                        # Save tool results as user message
+                        uow.save_message(
+                            session_id=session_id,
+                            role="user",
+                            content=tool_result_contents,
                         )
-                        tool_result_content = self._make_api_tool_result(
-                            result, content_block["id"]
+                        anthropic_messages.append(
+                            {"role": "user", "content": tool_result_contents}
                         )
-                        await self._handle_output(
-                            session_id, tool_result_content
-                        )
-                        tool_result_contents.append(tool_result_content)
+                    await uow.commit()
 
-                if not tool_result_contents:
-                    break
+                    for output in outputs:
+                        await self._handle_output(session_id, output)
 
-                # Save tool results as user message
-                SessionService.save_message(
-                    session_id=session_id,
-                    role="user",
-                    content=tool_result_contents,
-                )
+                    if not tool_result_contents:
+                        break
 
             # Broadcast end of assistant response
             await ws_manager.broadcast_to_session(
@@ -192,29 +220,104 @@ class ChatService:
             },
         )
 
-    async def get_session_messages(self, session_id: str) -> List[Message]:
-        """Get all messages for a session in chronological order.
+    async def get_session_message_rows(
+        self,
+        session_id: str,
+        limit: int | None = None,
+        before: str | None = None,
+        after: str | None = None,
+    ) -> tuple[list[sqlite3.Row], bool] | None:
+        """Get a page of message rows for a session in chronological order.
+
+        Messages are ordered by (created_at, id), and `before`/`after` are
+        message IDs used as exclusive cursors on that order. With `after`,
+        the page holds the first `limit` messages following it, which is how
+        a reconnecting client fetches only what it missed. Otherwise the page
+        holds the last `limit` messages (before `before`, if given). Without
+        `limit`, every matching message is returned. An archived session is
+        restored first.
+
+        Rows hold the message's id, session_id, role, content and
+        created_at columns as stored, so content may be compressed.
 
         Args:
             session_id: The ID of the session
+            limit: Maximum number of messages to return
+            before: Only return messages before this message ID
+            after: Only return messages after this message ID
 
         Returns:
-            List[Message]: List of messages, empty list if no messages exist
+            tuple[list[sqlite3.Row], bool]: The rows and whether more
+                matching messages exist beyond the page, or None if a cursor
+                is not a message in this session
         """
-        results = execute_query(
-            """
+        await ArchiveService.restore_session(session_id)
+
+        conditions = ["session_id = ?"]
+        params: list = [session_id]
+        for cursor_id, operator in ((after, ">"), (before, "<")):
+            if cursor_id is None:
+                continue
+            cursor = await db.fetch_one(
+                """
+                SELECT created_at, id
+                FROM messages
+                WHERE id = ? AND session_id = ?
+                """,
+                (cursor_id, session_id),
+            )
+            if cursor is None:
+                return None
+            conditions.append(f"(created_at, id) {operator} (?, ?)")
+            params.extend(cursor)
+
+        # Pages that don't start from `after` are taken from the end
+        order = "DESC" if limit is not None and after is None else "ASC"
+        query = f"""
             SELECT id, session_id, role, content, created_at
             FROM messages
-            WHERE session_id = ?
-            ORDER BY created_at ASC
-            """,
-            (session_id,),
+            WHERE {" AND ".join(conditions)}
+            ORDER BY created_at {order}, id {order}
+            """
+        if limit is not None:
+            # Fetch one extra row to tell whether there are more
+            query += "LIMIT ?"
+            params.append(limit + 1)
+
+        results = await db.fetch_all(query, params)
+        has_more = limit is not None and len(results) > limit
+        results = results[:limit]
+        if order == "DESC":
+            results.reverse()
+        return results, has_more
+
+    async def get_session_messages(
+        self,
+        session_id: str,
+        limit: int | None = None,
+        before: str | None = None,
+        after: str | None = None,
+    ) -> tuple[List[Message], bool] | None:
+        """Get a page of messages for a session in chronological order.
+
+        See `get_session_message_rows` for how pages are selected.
+
+        Returns:
+            tuple[List[Message], bool]: The messages and whether more
+                matching messages exist beyond the page, or None if a cursor
+                is not a message in this session
+        """
+        page = await self.get_session_message_rows(
+            session_id, limit=limit, before=before, after=after
         )
+        if page is None:
+            return None
+        results, has_more = page
 
         messages = []
         for row in results:
             try:
-                content = json.loads(row["content"])
+                content = json.loads(decode_content(row["content"]))
                 messages.append(
                     Message(
                         id=row["id"],
@@ -228,7 +331,7 @@ class ChatService:
                 logger.error(f"Failed to parse content for message {row['id']}")
                 continue
 
-        return messages
+        return messages, has_more
 
     async def _handle_output(
         self,
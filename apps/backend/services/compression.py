@@ -0,0 +1,95 @@
+import asyncio
+import logging
+
+from config import settings
+from utils.compression import compress_content
+from utils.database import db
+
+logger = logging.getLogger(__name__)
+
+
+class CompressionService:
+    @staticmethod
+    async def recompress_messages(
+        batch_size: int = settings.MESSAGE_RECOMPRESS_BATCH,
+        pause: float = 0.1,
+    ) -> int:
+        """Compress the content of messages stored uncompressed.
+
+        Works through the messages table in rowid order, a batch per
+        transaction, sleeping `pause` seconds between batches so chat writes
+        aren't held up. Content that doesn't shrink is left as it is.
+
+        Args:
+            batch_size: Messages examined per batch
+            pause: Seconds to wait between batches
+
+        Returns:
+            int: The number of messages compressed
+        """
+        if not settings.MESSAGE_COMPRESSION:
+            return 0
+
+        compressed = 0
+        last_rowid = 0
+        while True:
+            rows = await db.fetch_all(
+                """
+                SELECT rowid, id, session_id, content FROM messages
+                WHERE rowid > ? AND typeof(content) = 'text'
+                    AND length(content) >= ?
+                ORDER BY rowid
+                LIMIT ?
+                """,
+                (
+                    last_rowid,
+                    settings.MESSAGE_COMPRESSION_MIN_SIZE,
+                    batch_size,
+                ),
+            )
+            if not rows:
+                break
+            last_rowid = rows[-1]["rowid"]
+
+            updates = await asyncio.to_thread(
+                lambda: [
+                    (row, value)
+                    for row in rows
+                    if (value := compress_content(row["content"])) is not None
+                ]
+            )
+            if updates:
+                # Keep the session's stored size in step with the content
+                applied = 0
+                async with db.transaction() as conn:
+                    for row, value in updates:
+                        # Skipped if the message was deleted or changed
+                        # while it was being compressed, so a reused rowid
+                        # is never overwritten
+                        async with conn.execute(
+                            """
+                            UPDATE messages SET content = ?
+                            WHERE rowid = ? AND id = ? AND content = ?
+                            """,
+                            (value, row["rowid"], row["id"], row["content"]),
+                        ) as cursor:
+                            if cursor.rowcount != 1:
+                                continue
+                        await conn.execute(
+                            """
+                            UPDATE sessions
+                            SET stored_bytes = stored_bytes - ?
+                            WHERE id = ?
+                            """,
+                            (
+                                len(row["content"].encode()) - len(value),
+                                row["session_id"],
+                            ),
+                        )
+                        applied += 1
+                compressed += applied
+            await asyncio.sleep(pause)
+
+        if compressed:
+            logger.info(f"Compressed the content of {compressed} messages")
+        return compressed
@@ -1,17 +1,105 @@
+import asyncio
+import hashlib
 import os
+import tempfile
 import uuid
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 from config import settings
 from fastapi import UploadFile
 from models.base import FileMetadata
 from services.ws import ws_manager
-from utils.database import execute_query
+from utils.database import Write, db
+from utils.uploads import UPLOAD_DIR, upload_path
 
-UPLOAD_DIR = os.path.join(
-    os.path.dirname(os.path.dirname(__file__)), settings.UPLOAD_DIR
-)
+# Bytes read from an upload at a time
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload is larger than MAX_UPLOAD_SIZE."""
+
+
+def _write_chunk(f, hasher, chunk: bytes) -> None:
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+async def _receive_upload(
+    file: UploadFile, max_size: int = settings.MAX_UPLOAD_SIZE
+) -> tuple[str, int, str]:
+    """Stream an upload to a temporary file in UPLOAD_DIR.
+
+    Chunks are written and hashed off the event loop, so memory use stays
+    at one chunk whatever the file's size. Nothing is left behind if the
+    upload fails or goes over `max_size`.
+
+    Returns:
+        tuple[str, int, str]: The temporary file's path, the upload's size
+            and its SHA-256 hex digest
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix=".part")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadTooLargeError(
+                        f"File is larger than {max_size} bytes"
+                    )
+                await asyncio.to_thread(_write_chunk, f, hasher, chunk)
+    except BaseException:
+        await asyncio.to_thread(os.remove, tmp_path)
+        raise
+    return tmp_path, size, hasher.hexdigest()
+
+
+def _link_into_place(tmp_path: str, path: str) -> None:
+    """Give `tmp_path` a second name at `path`, replacing any file there"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        # Left behind without a reference, as by a crash
+        os.remove(path)
+        os.link(tmp_path, path)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def _release_upload_blobs(conn, hashes: list[str]) -> int:
+    """Remove stored uploads that no file references any more.
+
+    Runs inside the caller's transaction, which holds the write lock, so an
+    upload of the same bytes can't claim a stored file while it is removed.
+
+    Returns:
+        int: The number of stored files removed
+    """
+    removed = 0
+    for sha256 in hashes:
+        async with conn.execute(
+            """
+            DELETE FROM upload_blobs WHERE sha256 = ? AND refcount <= 0
+            RETURNING path
+            """,
+            (sha256,),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is not None:
+            await asyncio.to_thread(
+                _remove_quietly, os.path.join(UPLOAD_DIR, row["path"])
+            )
+            removed += 1
+    return removed
 
 
 class FileService:
@@ -24,55 +112,122 @@ class FileService:
     async def save_file(
         file: UploadFile, session_id: Optional[str] = None
     ) -> FileMetadata:
-        """Save an uploaded file and return its metadata."""
+        """Save an uploaded file and return its metadata.
+
+        The upload is streamed to disk in chunks and hashed as it goes, and
+        its bytes are stored once however many times they are uploaded.
+
+        Raises:
+            UploadTooLargeError: If the file is over MAX_UPLOAD_SIZE; nothing
+                is kept on disk
+        """
         FileService.ensure_upload_dir()
 
-        # Generate unique ID and safe filename
-        file_id = str(uuid.uuid4())
-        original_name = file.filename
-        file_ext = os.path.splitext(original_name)[1]
-        base_name = os.path.splitext(original_name)[0]
-        # Replace spaces and special chars with underscores
-        safe_base_name = ''.join(c if c.isalnum() else '_' for c in base_name)
-        safe_filename = f"{safe_base_name}_{file_id}{file_ext}"
-
-        # Save file to disk
-        file_path = os.path.join(UPLOAD_DIR, safe_filename)
-        content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
-
-        # Get file size
-        file_size = os.path.getsize(file_path)
-
-        # Record in database
-        now = datetime.utcnow()
-        execute_query(
-            """
-            INSERT INTO files (id, filename, path, mime_type, size, uploaded_at, created_at, updated_at, session_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                file_id,
+        tmp_path, file_size, sha256 = await _receive_upload(file)
+        try:
+            return await FileService.store_file(
+                tmp_path,
                 file.filename,
-                safe_filename,
                 file.content_type,
                 file_size,
-                now,
-                now,
-                None,
+                sha256,
                 session_id,
-            ),
-        )
+            )
+        except BaseException:
+            await asyncio.to_thread(_remove_quietly, tmp_path)
+            raise
+
+    @staticmethod
+    async def store_file(
+        tmp_path: str,
+        filename: str,
+        mime_type: Optional[str],
+        size: int,
+        sha256: str,
+        session_id: Optional[str] = None,
+        writes: Sequence[Write] = (),
+    ) -> FileMetadata:
+        """Record a received upload, removing its temporary file once done.
+
+        The bytes are kept only if no earlier upload had them. The stored
+        file and its reference are claimed under the write lock, so
+        concurrent uploads of the same bytes share one copy. The temporary
+        file is only removed once the transaction has committed; if it
+        fails, the temporary file is left as it was for the caller.
+
+        Args:
+            tmp_path: The upload's temporary file, inside UPLOAD_DIR
+            filename: The name the file was uploaded with
+            mime_type: The file's content type
+            size: The file's size in bytes
+            sha256: The SHA-256 hex digest of the file's content
+            session_id: Session to associate the file with
+            writes: Further writes to make in the same transaction
+
+        Returns:
+            FileMetadata: The new file's metadata
+        """
+        file_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        stored_path = None
+        try:
+            async with db.transaction() as conn:
+                async with conn.execute(
+                    "SELECT path FROM upload_blobs WHERE sha256 = ?",
+                    (sha256,),
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row is not None:
+                    path = row["path"]
+                else:
+                    path = upload_path(sha256, os.path.splitext(filename)[1])
+                    stored_path = os.path.join(UPLOAD_DIR, path)
+                    await asyncio.to_thread(
+                        _link_into_place, tmp_path, stored_path
+                    )
+                    await conn.execute(
+                        """
+                        INSERT INTO upload_blobs
+                            (sha256, path, size, refcount, created_at)
+                        VALUES (?, ?, ?, 0, ?)
+                        """,
+                        (sha256, path, size, now),
+                    )
+                await conn.execute(
+                    """
+                    INSERT INTO files (id, filename, path, mime_type, size, uploaded_at, created_at, updated_at, session_id, sha256)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        file_id,
+                        filename,
+                        path,
+                        mime_type,
+                        size,
+                        now,
+                        now,
+                        None,
+                        session_id,
+                        sha256,
+                    ),
+                )
+                for query, params in writes:
+                    await conn.execute(query, params)
+        except BaseException:
+            if stored_path is not None:
+                await asyncio.to_thread(_remove_quietly, stored_path)
+            raise
+        await asyncio.to_thread(_remove_quietly, tmp_path)
 
         file_obj = FileMetadata(
             id=file_id,
-            filename=file.filename,
-            path=safe_filename,
-            mime_type=file.content_type,
-            size=file_size,
+            filename=filename,
+            path=path,
+            mime_type=mime_type,
+            size=size,
             uploaded_at=now,
             session_id=session_id,
+            sha256=sha256,
         )
 
         # Notify via WebSocket if associated with a session
@@ -84,14 +239,15 @@ class FileService:
         return file_obj
 
     @staticmethod
-    def get_file(file_id: str) -> Optional[FileMetadata]:
+    async def get_file(file_id: str) -> Optional[FileMetadata]:
         """Get file metadata by ID."""
-        result = execute_query("SELECT * FROM files WHERE id = ?", (file_id,))
+        file = await db.fetch_one(
+            "SELECT * FROM files WHERE id = ?", (file_id,)
+        )
 
-        if not result:
+        if not file:
             return None
 
-        file = result[0]
         return FileMetadata(
             id=file["id"],
             filename=file["filename"],
@@ -102,10 +258,13 @@ class FileService:
             session_id=file["session_id"],
             created_at=file["created_at"],
             updated_at=file["updated_at"],
+            sha256=file["sha256"],
         )
 
     @staticmethod
-    def list_files(session_id: Optional[str] = None) -> List[FileMetadata]:
+    async def list_files(
+        session_id: Optional[str] = None,
+    ) -> List[FileMetadata]:
         """Get a list of files, optionally filtered by session."""
         query = "SELECT * FROM files"
         params = ()
@@ -114,7 +273,7 @@ class FileService:
             query += " WHERE session_id = ?"
             params = (session_id,)
 
-        results = execute_query(query, params)
+        results = await db.fetch_all(query, params)
         return [
             FileMetadata(
                 id=file["id"],
@@ -126,34 +285,41 @@ class FileService:
                 session_id=file["session_id"],
                 created_at=file["created_at"],
                 updated_at=file["updated_at"],
+                sha256=file["sha256"],
             )
             for file in results
         ]
 
     @staticmethod
     async def delete_file(file_id: str) -> bool:
-        """Delete a file and its database record"""
-        # Get file info first
-        file = FileService.get_file(file_id)
-        if not file:
-            return False
-
-        # Delete from disk
-        file_path = os.path.join(UPLOAD_DIR, file.path)
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except OSError:
-            # Log error but continue to remove DB record
-            print(f"Error deleting file {file_path}")
-
-        # Delete from database
-        execute_query("DELETE FROM files WHERE id = ?", (file_id,))
+        """Delete a file's record, and its bytes if no other file shares them"""
+        async with db.transaction() as conn:
+            async with conn.execute(
+                "DELETE FROM files WHERE id = ? RETURNING session_id, sha256",
+                (file_id,),
+            ) as cursor:
+                file = await cursor.fetchone()
+            if file is None:
+                return False
+            if file["sha256"] is not None:
+                await _release_upload_blobs(conn, [file["sha256"]])
 
         # Notify via WebSocket if associated with a session
-        if file.session_id:
+        if file["session_id"]:
             await ws_manager.broadcast_file_update(
-                file.session_id, "delete", file_id
+                file["session_id"], "delete", file_id
             )
 
         return True
+
+    @staticmethod
+    async def release_uploads(hashes: list[str]) -> int:
+        """Remove the stored uploads among `hashes` no file references.
+
+        Returns:
+            int: The number of stored files removed
+        """
+        if not hashes:
+            return 0
+        async with db.transaction() as conn:
+            return await _release_upload_blobs(conn, hashes)
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from config import settings
+from models.base import FileMetadata
+from utils.previews import (
+    TEXT_MEDIA_TYPE,
+    THUMBNAIL_MEDIA_TYPE,
+    render_text_head,
+    render_thumbnail,
+)
+from utils.uploads import UPLOAD_DIR
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), settings.PREVIEW_DIR
+)
+
+
+def _preview_name(file: FileMetadata) -> tuple[str, str]:
+    """Cache file name and media type of a file's preview"""
+    if file.mime_type.startswith("image/"):
+        return (
+            f"{file.sha256}-{settings.PREVIEW_IMAGE_SIZE}.webp",
+            THUMBNAIL_MEDIA_TYPE,
+        )
+    return f"{file.sha256}-{settings.PREVIEW_TEXT_BYTES}.txt", TEXT_MEDIA_TYPE
+
+
+def _cache_size() -> int:
+    if not os.path.isdir(PREVIEW_DIR):
+        return 0
+    return sum(
+        entry.stat().st_size
+        for subdir in os.scandir(PREVIEW_DIR)
+        if subdir.is_dir()
+        for entry in os.scandir(subdir.path)
+        if entry.is_file()
+    )
+
+
+def _evict(target: int) -> int:
+    """Remove least recently used previews until the cache is under target.
+
+    Returns:
+        int: The size of the cache afterwards
+    """
+    entries = [
+        entry
+        for subdir in os.scandir(PREVIEW_DIR)
+        if subdir.is_dir()
+        for entry in os.scandir(subdir.path)
+        if entry.is_file()
+    ]
+    stats = sorted(
+        ((entry.stat(), entry.path) for entry in entries),
+        key=lambda item: item[0].st_mtime,
+    )
+    size = sum(stat.st_size for stat, _ in stats)
+    for stat, path in stats:
+        if size <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        size -= stat.st_size
+    return size
+
+
+class PreviewService:
+    """Thumbnails of images and the heads of text files, cached on disk.
+
+    Previews are keyed by the SHA-256 of the file's content, so files with
+    the same bytes share one. A preview's modification time is refreshed
+    whenever it is served, and once the cache grows past PREVIEW_CACHE_SIZE
+    the least recently used previews are evicted.
+    """
+
+    # Previews being rendered, so concurrent requests render each once
+    _pending: dict[str, asyncio.Task] = {}
+    # Bytes in the cache, counted on first use
+    _size: Optional[int] = None
+    _evicting = False
+
+    @staticmethod
+    async def get_preview(file: FileMetadata) -> Optional[tuple[str, str]]:
+        """Get a file's preview, rendering it if it isn't cached.
+
+        Args:
+            file: The file to preview
+
+        Returns:
+            tuple[str, str]: The preview's path and media type, or None if
+                the file has no preview
+        """
+        if file.sha256 is None:
+            return None
+        name, media_type = _preview_name(file)
+        path = os.path.join(PREVIEW_DIR, name[:2], name)
+        try:
+            # Marks the preview as recently used
+            await asyncio.to_thread(os.utime, path)
+            return path, media_type
+        except FileNotFoundError:
+            pass
+
+        task = PreviewService._pending.get(name)
+        if task is None:
+            task = asyncio.create_task(
+                PreviewService._render(file, path, media_type)
+            )
+            PreviewService._pending[name] = task
+            task.add_done_callback(
+                lambda _: PreviewService._pending.pop(name, None)
+            )
+        # Shielded, so a cancelled request doesn't cancel other waiters
+        if not await asyncio.shield(task):
+            return None
+        return path, media_type
+
+    @staticmethod
+    async def _render(file: FileMetadata, path: str, media_type: str) -> bool:
+        src = os.path.join(UPLOAD_DIR, file.path)
+        if media_type == THUMBNAIL_MEDIA_TYPE:
+            render, limit = render_thumbnail, settings.PREVIEW_IMAGE_SIZE
+        else:
+            render, limit = render_text_head, settings.PREVIEW_TEXT_BYTES
+        try:
+            rendered = await asyncio.to_thread(render, src, path, limit)
+        except FileNotFoundError:
+            return False
+        if rendered:
+            size = await asyncio.to_thread(os.path.getsize, path)
+            await PreviewService._account(size)
+        return rendered
+
+    @staticmethod
+    async def _account(added: int) -> None:
+        """Count a new preview, evicting old ones if the cache is too big"""
+        if PreviewService._size is None:
+            PreviewService._size = await asyncio.to_thread(_cache_size)
+        else:
+            PreviewService._size += added
+        if (
+            PreviewService._size <= settings.PREVIEW_CACHE_SIZE
+            or PreviewService._evicting
+        ):
+            return
+
+        PreviewService._evicting = True
+        try:
+            # Evict down to 90%, so eviction isn't run for every new preview
+            PreviewService._size = await asyncio.to_thread(
+                _evict, settings.PREVIEW_CACHE_SIZE * 9 // 10
+            )
+        finally:
+            PreviewService._evicting = False
+        logger.info(f"Evicted previews; cache is {PreviewService._size} bytes")
@@ -1,26 +1,157 @@
+import asyncio
+import json
 import logging
+import os
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Optional
-
-from models.base import Message, Session
-from utils.database import execute_query
+from typing import AsyncIterator, List, Optional
+
+from config import settings
+from models.base import (
+    Message,
+    MessageMatch,
+    Session,
+    SessionMatch,
+    SessionSummary,
+)
+from services.blob import BlobService
+from services.file import FileService
+from services.upload import UploadService
+from utils.archive import archive_path
+from utils.blobs import blob_hashes
+from utils.compression import decode_content, encode_content
+from utils.database import Write, db
+from utils.search import match_query, message_text
+from utils.tasks import start_background_task
 
 logger = logging.getLogger(__name__)
 
+# Longest wait, in seconds, between retries of a failed write-behind flush
+_MAX_RETRY_DELAY = 60
+
+# Most recent matching messages ranked per search
+SEARCH_RANK_WINDOW = 5000
+
+# Columns sessions can be listed by
+SESSION_SORT_COLUMNS = {
+    "activity": "last_active_at",
+    "created": "created_at",
+}
+
+
+async def _apply(writes: list[Write]) -> None:
+    async with db.transaction() as conn:
+        for query, params in writes:
+            await conn.execute(query, params)
+
+
+class WriteBehindQueue:
+    """Applies batches of writes in the background, in submission order.
+
+    Pending batches are written together in one transaction `interval`
+    seconds after the first is submitted, or as soon as `flush` is awaited.
+    A failed flush keeps its batches and is retried with backoff.
+    Batches are never split, so a crash can lose the latest batches but
+    never leave part of one behind.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: list[list[Write]] = []
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def submit(self, batch: list[Write]) -> None:
+        self._pending.append(batch)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        delay = self.interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+                return
+            except Exception:
+                # Back off, so a database that stays unavailable isn't
+                # retried in a tight loop
+                delay = min(max(delay * 2, 1), _MAX_RETRY_DELAY)
+                logger.exception(
+                    f"Failed to flush queued writes; retrying in {delay:g}s"
+                )
+
+    async def flush(self) -> None:
+        """Write all pending batches now"""
+        async with self._lock:
+            batches, self._pending = self._pending, []
+            if not batches:
+                return
+            try:
+                await _apply([write for batch in batches for write in batch])
+            except BaseException:
+                # Keep them, ahead of anything submitted meanwhile
+                self._pending[:0] = batches
+                raise
+
+
+message_write_queue = WriteBehindQueue(settings.MESSAGE_FLUSH_INTERVAL)
+
+
+class UnitOfWork:
+    """Groups message writes so they are applied in a single transaction.
+
+    `save_message` queues writes and `commit` applies everything queued so
+    far atomically, either right away or through the write-behind queue.
+    Writes that haven't been committed when the unit of work fails are
+    discarded.
+    """
+
+    def __init__(self, write_behind: WriteBehindQueue | None = None):
+        self._writes: list[Write] = []
+        self._write_behind = write_behind
+
+    def save_message(
+        self,
+        session_id: str,
+        role: str,
+        content: list[dict] | str,
+        message: str | None = None,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+    ) -> str:
+        """Queue a message to be saved on the next commit; return its ID"""
+        msg_id, writes = SessionService._message_writes(
+            session_id, role, content, message, input_tokens, output_tokens
+        )
+        self._writes.extend(writes)
+        return msg_id
+
+    async def commit(self) -> None:
+        writes, self._writes = self._writes, []
+        if not writes:
+            return
+        if self._write_behind is not None:
+            self._write_behind.submit(writes)
+        else:
+            await _apply(writes)
+
 
 class SessionService:
     @staticmethod
-    def create_session(title: str) -> Session:
+    async def create_session(title: str) -> Session:
         session_id = str(uuid.uuid4())
         now = datetime.utcnow()
 
-        execute_query(
+        await db.execute(
             """
-            INSERT INTO sessions (id, title, status, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO sessions (
+                id, title, status, created_at, updated_at, last_active_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (session_id, title, "active", now, now),
+            (session_id, title, "active", now, now, now.isoformat()),
         )
 
         return Session(
@@ -32,15 +163,14 @@ class SessionService:
         )
 
     @staticmethod
-    def get_session(session_id: str) -> Optional[Session]:
-        result = execute_query(
+    async def get_session(session_id: str) -> Optional[Session]:
+        session = await db.fetch_one(
             "SELECT * FROM sessions WHERE id = ?", (session_id,)
         )
 
-        if not result:
+        if not session:
             return None
 
-        session = result[0]
         return Session(
             id=session["id"],
             title=session["title"],
@@ -50,11 +180,13 @@ class SessionService:
         )
 
     @staticmethod
-    def save_message(
+    async def save_message(
         session_id: str,
         role: str,
         content: list[dict] | str,
         message: str | None = None,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
     ) -> str:
         """Save a message to the database.
 
@@ -63,55 +195,303 @@ class SessionService:
             role: The role (user/assistant)
             content: Content block dict or string to convert to text block
             message: Human-readable message text
+            input_tokens: Input tokens used to generate the message
+            output_tokens: Output tokens used to generate the message
 
         Returns:
             str: The ID of the created message
         """
-        import json
+        msg_id, writes = SessionService._message_writes(
+            session_id, role, content, message, input_tokens, output_tokens
+        )
+        await _apply(writes)
+        return msg_id
 
+    @staticmethod
+    def _message_writes(
+        session_id: str,
+        role: str,
+        content: list[dict] | str,
+        message: str | None = None,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+    ) -> tuple[str, list[Write]]:
+        """Build the writes that save a new message, returning its ID too.
+
+        Inline images are moved to the blob store and referenced by hash,
+        the content's text is added to the search index, and the content is
+        compressed if it is large enough. The session's summary columns are
+        updated to match.
+        """
         msg_id = str(uuid.uuid4())
+        created_at = datetime.utcnow().isoformat()
 
         # Convert string content to a text block array
         if isinstance(content, str):
             content = [{"type": "text", "text": content}]
 
-        content_json = json.dumps(content)
+        content, writes = BlobService.extract(content)
+        insert_writes, stored_bytes = SessionService._insert_message_writes(
+            msg_id, session_id, role, content, message, created_at
+        )
+        writes.extend(insert_writes)
+        writes.append(
+            (
+                """
+                UPDATE sessions SET
+                    message_count = message_count + 1,
+                    last_message_at = ?,
+                    last_active_at = ?,
+                    input_tokens = input_tokens + ?,
+                    output_tokens = output_tokens + ?,
+                    stored_bytes = stored_bytes + ?
+                WHERE id = ?
+                """,
+                (
+                    created_at,
+                    created_at,
+                    input_tokens,
+                    output_tokens,
+                    stored_bytes,
+                    session_id,
+                ),
+            )
+        )
+        return msg_id, writes
 
-        execute_query(
-            """
-            INSERT INTO messages (id, session_id, role, content, message, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
+    @staticmethod
+    def _insert_message_writes(
+        msg_id: str,
+        session_id: str,
+        role: str,
+        content: list[dict],
+        message: str | None,
+        created_at: str,
+    ) -> tuple[list[Write], int]:
+        """Build the writes that insert a message row, its search entry and
+        its blob references.
+
+        The content's images must already reference blobs. Returns the
+        writes and the number of bytes the content is stored in.
+        """
+        stored = encode_content(json.dumps(content))
+        stored_bytes = len(
+            stored.encode() if isinstance(stored, str) else stored
+        )
+        writes = [
             (
-                msg_id,
-                session_id,
-                role,
-                content_json,
-                message,
-                datetime.utcnow().isoformat(),
+                "INSERT INTO messages_fts (text, message_id) VALUES (?, ?)",
+                (message_text(content), msg_id),
             ),
-        )
+            # The message keeps the rowid of its search index entry, so the
+            # delete trigger can find it
+            (
+                """
+                INSERT INTO messages (
+                    id, session_id, role, content, message, created_at,
+                    fts_rowid
+                )
+                VALUES (?, ?, ?, ?, ?, ?, last_insert_rowid())
+                """,
+                (msg_id, session_id, role, stored, message, created_at),
+            ),
+            *(
+                (
+                    """
+                    INSERT OR IGNORE INTO message_blobs (message_id, hash)
+                    VALUES (?, ?)
+                    """,
+                    (msg_id, digest),
+                )
+                for digest in blob_hashes(content)
+            ),
+        ]
+        return writes, stored_bytes
 
-        return msg_id
+    @staticmethod
+    @asynccontextmanager
+    async def unit_of_work(
+        write_behind: bool = settings.MESSAGE_WRITE_BEHIND,
+    ) -> AsyncIterator[UnitOfWork]:
+        """Group message writes into transactions.
+
+        Whatever is still queued when the block exits normally is committed.
+        With `write_behind`, commits are handed to the write-behind queue,
+        which is drained when the block exits.
+
+        Args:
+            write_behind: Whether to defer commits to the write-behind queue
+
+        Yields:
+            UnitOfWork: The unit of work to queue writes on
+        """
+        uow = UnitOfWork(message_write_queue if write_behind else None)
+        try:
+            yield uow
+            await uow.commit()
+        finally:
+            if write_behind:
+                await message_write_queue.flush()
 
     @staticmethod
-    def list_sessions() -> List[Session]:
-        results = execute_query(
-            "SELECT * FROM sessions ORDER BY created_at DESC"
-        )
-        return [
-            Session(
+    async def list_sessions(
+        limit: int | None = None,
+        before: str | None = None,
+        sort: str = "activity",
+        status: str | None = None,
+    ) -> tuple[List[SessionSummary], bool] | None:
+        """Get a page of sessions, newest first, with their summaries.
+
+        Sessions are ordered by last activity (their last message, or their
+        creation if they have none) or by creation time, then by ID, and
+        `before` is a session ID used as an exclusive cursor on that order.
+        Every combination of sort and status filter is served by an index.
+
+        Args:
+            limit: Maximum number of sessions to return
+            before: Only return sessions after this one in the order
+            sort: "activity" or "created"
+            status: Only return sessions with this status
+
+        Returns:
+            tuple[List[SessionSummary], bool]: The sessions and whether more
+                exist beyond the page, or None if the cursor is not a
+                session
+        """
+        column = SESSION_SORT_COLUMNS[sort]
+        conditions = []
+        params: list = []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if before is not None:
+            cursor = await db.fetch_one(
+                f"SELECT {column}, id FROM sessions WHERE id = ?", (before,)
+            )
+            if cursor is None:
+                return None
+            conditions.append(f"({column}, id) < (?, ?)")
+            params.extend(cursor)
+
+        query = "SELECT * FROM sessions"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += f" ORDER BY {column} DESC, id DESC"
+        if limit is not None:
+            # Fetch one extra row to tell whether there are more
+            query += " LIMIT ?"
+            params.append(limit + 1)
+
+        results = await db.fetch_all(query, params)
+        has_more = limit is not None and len(results) > limit
+        sessions = [
+            SessionSummary(
                 id=row["id"],
                 title=row["title"],
                 created_at=row["created_at"],
                 updated_at=row["updated_at"],
                 status=row["status"],
+                message_count=row["message_count"],
+                last_message_at=row["last_message_at"],
+                input_tokens=row["input_tokens"],
+                output_tokens=row["output_tokens"],
+                stored_bytes=row["stored_bytes"],
+                archived_at=row["archived_at"],
             )
-            for row in results
+            for row in results[:limit]
         ]
+        return sessions, has_more
 
     @staticmethod
-    def update_session(
+    async def search_sessions(
+        query: str, limit: int = 20, matches_per_session: int = 3
+    ) -> List[SessionMatch]:
+        """Find sessions whose messages match a full-text search query.
+
+        Every word of the query must appear in a message for it to match.
+        Messages are ranked by relevance among the `SEARCH_RANK_WINDOW` most
+        recent matches, so queries for common words don't have to score
+        every message, and sessions are ranked by their best message.
+
+        Args:
+            query: The words to search for
+            limit: Maximum number of sessions to return
+            matches_per_session: Maximum number of messages per session
+
+        Returns:
+            List[SessionMatch]: Matching sessions, best first, with
+                snippets of their best matching messages
+        """
+        match = match_query(query)
+        if match is None:
+            return []
+
+        # Index rowids grow with insertion, so the window is a rowid range.
+        # Only the best ranked messages are joined and excerpted
+        results = await db.fetch_all(
+            """
+            SELECT
+                hits.message_id, hits.snippet, m.role, m.created_at,
+                s.id AS session_id, s.title, s.status,
+                s.created_at AS session_created_at,
+                s.updated_at AS session_updated_at
+            FROM (
+                SELECT
+                    message_id,
+                    snippet(messages_fts, 0, '**', '**', '…', 16) AS snippet,
+                    rank
+                FROM messages_fts
+                WHERE messages_fts MATCH :match AND rowid >= (
+                    SELECT coalesce(min(rowid), 0) FROM (
+                        SELECT rowid FROM messages_fts
+                        WHERE messages_fts MATCH :match
+                        ORDER BY rowid DESC
+                        LIMIT :window
+                    )
+                )
+                ORDER BY rank
+                LIMIT :hits
+            ) AS hits
+            JOIN messages m ON m.id = hits.message_id
+            JOIN sessions s ON s.id = m.session_id
+            ORDER BY hits.rank
+            """,
+            {
+                "match": match,
+                "window": SEARCH_RANK_WINDOW,
+                "hits": limit * matches_per_session * 4,
+            },
+        )
+
+        sessions: dict[str, SessionMatch] = {}
+        for row in results:
+            session_match = sessions.get(row["session_id"])
+            if session_match is None:
+                if len(sessions) == limit:
+                    continue
+                session_match = sessions[row["session_id"]] = SessionMatch(
+                    session=Session(
+                        id=row["session_id"],
+                        title=row["title"],
+                        created_at=row["session_created_at"],
+                        updated_at=row["session_updated_at"],
+                        status=row["status"],
+                    ),
+                    messages=[],
+                )
+            if len(session_match.messages) < matches_per_session:
+                session_match.messages.append(
+                    MessageMatch(
+                        message_id=row["message_id"],
+                        role=row["role"],
+                        created_at=row["created_at"],
+                        snippet=row["snippet"],
+                    )
+                )
+        return list(sessions.values())
+
+    @staticmethod
+    async def update_session(
         session_id: str, title: str = None, status: str = None
     ) -> Optional[Session]:
         updates = []
@@ -138,44 +518,86 @@ class SessionService:
             WHERE id = ?
         """
 
-        execute_query(query, tuple(params))
-        return SessionService.get_session(session_id)
+        await db.execute(query, tuple(params))
+        return await SessionService.get_session(session_id)
 
     @staticmethod
-    def delete_session(session_id: str) -> bool:
+    async def delete_session(session_id: str) -> bool:
         """Delete a session and all its associated data.
 
+        The session row is deleted in a single transaction, and foreign key
+        cascades remove its messages, their search entries and blob
+        references, and its file and resumable upload records with it.
+        Uploads and blobs no other file or message uses, partial uploads and
+        the session's archive are cleaned up in the background afterwards.
+
         Args:
             session_id: The ID of the session to delete
 
         Returns:
             bool: True if session was found and deleted, False otherwise
         """
-        # Check if session exists
-        session = SessionService.get_session(session_id)
-        if not session:
-            return False
-
-        # Delete associated data
-        execute_query(
-            "DELETE FROM messages WHERE session_id = ?", (session_id,)
+        async with db.transaction() as conn:
+            async with conn.execute(
+                """
+                SELECT DISTINCT sha256 FROM files
+                WHERE session_id = ? AND sha256 IS NOT NULL
+                """,
+                (session_id,),
+            ) as cursor:
+                uploads = [row["sha256"] for row in await cursor.fetchall()]
+            async with conn.execute(
+                "SELECT id FROM uploads WHERE session_id = ?", (session_id,)
+            ) as cursor:
+                incoming = [row["id"] for row in await cursor.fetchall()]
+            async with conn.execute(
+                """
+                SELECT DISTINCT message_blobs.hash
+                FROM messages
+                JOIN message_blobs ON message_blobs.message_id = messages.id
+                WHERE messages.session_id = ?
+                """,
+                (session_id,),
+            ) as cursor:
+                hashes = [row["hash"] for row in await cursor.fetchall()]
+            async with conn.execute(
+                "DELETE FROM sessions WHERE id = ?", (session_id,)
+            ) as cursor:
+                if cursor.rowcount == 0:
+                    return False
+
+        start_background_task(
+            SessionService._clean_up_deleted_session(
+                session_id, uploads, incoming, hashes
+            ),
+            f"clean-up-session-{session_id}",
         )
-        execute_query("DELETE FROM files WHERE session_id = ?", (session_id,))
-
-        # Delete the session
-        execute_query("DELETE FROM sessions WHERE id = ?", (session_id,))
         return True
 
     @staticmethod
-    def get_session_messages(session_id: str) -> List[Message]:
+    async def _clean_up_deleted_session(
+        session_id: str,
+        uploads: list[str],
+        incoming: list[str],
+        hashes: list[str],
+    ) -> None:
+        """Remove what a deleted session leaves outside the database"""
+        await FileService.release_uploads(uploads)
+        await UploadService.remove_parts(incoming)
+        try:
+            await asyncio.to_thread(os.remove, archive_path(session_id))
+        except FileNotFoundError:
+            pass
+        await BlobService.delete_orphans(hashes)
+
+    @staticmethod
+    async def get_session_messages(session_id: str) -> List[Message]:
         """Get all messages for a session in chronological order.
 
         Returns:
             List[Message]: List of messages with their content and optional message
         """
-        import json
-
-        results = execute_query(
+        results = await db.fetch_all(
             """
             SELECT id, session_id, role, content, message, created_at
             FROM messages
@@ -188,10 +610,7 @@ class SessionService:
         messages = []
         for row in results:
             try:
-                content = json.loads(row["content"])
-                logger.info(
-                    f"Loaded content from DB: {content} (type: {type(content)})"
-                )
+                content = json.loads(decode_content(row["content"]))
                 # If content is not a list, wrap it in one
                 if not isinstance(content, list):
                     content = [content]
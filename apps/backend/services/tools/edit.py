@@ -1,9 +1,10 @@
-from collections import defaultdict
 from pathlib import Path
 from typing import Any, Literal, get_args
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .fileio import MappedLines, atomic_write_text, list_directory, run_io
+from .history import FileHistory
+from .run import MAX_RESPONSE_LEN, maybe_truncate
 
 Command = Literal[
     "view",
@@ -11,6 +12,7 @@ Command = Literal[
     "str_replace",
     "insert",
     "undo_edit",
+    "multi_edit",
 ]
 SNIPPET_LINES: int = 4
 
@@ -24,10 +26,10 @@ class EditTool20250124(BaseAnthropicTool):
     api_type: Literal["text_editor_20250124"] = "text_editor_20250124"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    _file_history: FileHistory
 
     def __init__(self):
-        self._file_history = defaultdict(list)
+        self._file_history = FileHistory()
         super().__init__()
 
     def to_params(self) -> Any:
@@ -46,6 +48,7 @@ class EditTool20250124(BaseAnthropicTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[dict[str, Any]] | None = None,
         **kwargs,
     ):
         _path = Path(path)
@@ -55,15 +58,15 @@ class EditTool20250124(BaseAnthropicTool):
         elif command == "create":
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
-            self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            await self.write_file(_path, file_text)
+            self._file_history.push(_path, file_text)
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
                 raise ToolError(
                     "Parameter `old_str` is required for command: str_replace"
                 )
-            return self.str_replace(_path, old_str, new_str)
+            return await self.str_replace(_path, old_str, new_str)
         elif command == "insert":
             if insert_line is None:
                 raise ToolError(
@@ -71,9 +74,15 @@ class EditTool20250124(BaseAnthropicTool):
                 )
             if new_str is None:
                 raise ToolError("Parameter `new_str` is required for command: insert")
-            return self.insert(_path, insert_line, new_str)
+            return await self.insert(_path, insert_line, new_str)
         elif command == "undo_edit":
-            return self.undo_edit(_path)
+            return await self.undo_edit(_path)
+        elif command == "multi_edit":
+            if not edits:
+                raise ToolError(
+                    "Parameter `edits` is required for command: multi_edit"
+                )
+            return await self.multi_edit(_path, edits)
         raise ToolError(
             f'Unrecognized command {command}. The allowed commands for the {self.name} tool are: {", ".join(get_args(Command))}'
         )
@@ -112,96 +121,213 @@ class EditTool20250124(BaseAnthropicTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
-            )
+            stdout, stderr = await run_io(list_directory, path)
+            stdout = maybe_truncate(stdout)
             if not stderr:
                 stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
             return CLIResult(output=stdout, error=stderr)
 
-        file_content = self.read_file(path)
         init_line = 1
         if view_range:
             if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
                 raise ToolError(
                     "Invalid `view_range`. It should be a list of two integers."
                 )
-            file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
-            init_line, final_line = view_range
-            if init_line < 1 or init_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
-                )
-            if final_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
-                )
-            if final_line != -1 and final_line < init_line:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
-                )
-
-            if final_line == -1:
-                file_content = "\n".join(file_lines[init_line - 1 :])
-            else:
-                file_content = "\n".join(file_lines[init_line - 1 : final_line])
+            init_line = view_range[0]
+            file_content = await self.read_line_range(path, view_range)
+        else:
+            file_content = await self.read_file(path)
 
         return CLIResult(
             output=self._make_output(file_content, str(path), init_line=init_line)
         )
 
-    def str_replace(self, path: Path, old_str: str, new_str: str | None):
-        """Implement the str_replace command, which replaces old_str with new_str in the file content"""
-        # Read the file content
-        file_content = self.read_file(path).expandtabs()
-        old_str = old_str.expandtabs()
-        new_str = new_str.expandtabs() if new_str is not None else ""
+    async def read_line_range(self, path: Path, view_range: list[int]) -> str:
+        """Read the lines in `view_range` from a file, seeking straight to them through a cached line index when possible."""
+        init_line, final_line = view_range
+        try:
+            file_content = await run_io(self._read_mapped_range, path, view_range)
+        except (OSError, ValueError) as e:
+            raise ToolError(f"Ran into {e} while trying to read {path}") from None
+        if file_content is not None:
+            return file_content
+
+        file_lines = (await self.read_file(path)).split("\n")
+        self._validate_view_range(view_range, len(file_lines))
+        if final_line == -1:
+            return "\n".join(file_lines[init_line - 1 :])
+        return "\n".join(file_lines[init_line - 1 : final_line])
+
+    def _read_mapped_range(self, path: Path, view_range: list[int]) -> str | None:
+        with MappedLines.open(path) as lines:
+            if lines is None:
+                return None
+            self._validate_view_range(view_range, lines.n_lines)
+            init_line, final_line = view_range
+            return lines.read(init_line, final_line, max_chars=MAX_RESPONSE_LEN)
 
-        # Check if old_str is unique in the file
-        occurrences = file_content.count(old_str)
-        if occurrences == 0:
+    def _validate_view_range(self, view_range: list[int], n_lines_file: int):
+        init_line, final_line = view_range
+        if init_line < 1 or init_line > n_lines_file:
             raise ToolError(
-                f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
+                f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
             )
-        elif occurrences > 1:
-            file_content_lines = file_content.split("\n")
-            lines = [
-                idx + 1
-                for idx, line in enumerate(file_content_lines)
-                if old_str in line
-            ]
+        if final_line > n_lines_file:
             raise ToolError(
-                f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
+            )
+        if final_line != -1 and final_line < init_line:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
             )
 
+    async def str_replace(self, path: Path, old_str: str, new_str: str | None):
+        """Implement the str_replace command, which replaces old_str with new_str in the file content"""
+        # Read the file content
+        file_content = (await self.read_file(path)).expandtabs()
+        old_str = old_str.expandtabs()
+        new_str = new_str.expandtabs() if new_str is not None else ""
+
+        # Find old_str, checking that it is unique in the same scan
+        offset = self._find_unique(path, file_content, old_str)
+
         # Replace old_str with new_str
-        new_file_content = file_content.replace(old_str, new_str)
+        new_file_content = (
+            file_content[:offset] + new_str + file_content[offset + len(old_str) :]
+        )
 
         # Write the new content to the file
-        self.write_file(path, new_file_content)
+        await self.write_file(path, new_file_content)
 
         # Save the content to history
-        self._file_history[path].append(file_content)
+        self._file_history.push(path, file_content)
 
-        # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
-        start_line = max(0, replacement_line - SNIPPET_LINES)
-        end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
-        snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
-
-        # Prepare the success message
+        # Prepare the success message with a snippet of the edited section
         success_msg = f"The file {path} has been edited. "
-        success_msg += self._make_output(
-            snippet, f"a snippet of {path}", start_line + 1
+        success_msg += self._make_snippets_output(
+            new_file_content, [(offset, offset + len(new_str))], str(path)
         )
         success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
 
         return CLIResult(output=success_msg)
 
-    def insert(self, path: Path, insert_line: int, new_str: str):
+    async def multi_edit(self, path: Path, edits: list[dict[str, Any]]):
+        """Implement the multi_edit command, which applies a list of str_replace edits in order and writes the file once, only if every edit succeeds."""
+        file_content = (await self.read_file(path)).expandtabs()
+        new_file_content = file_content
+
+        # Spans of the replaced text in new_file_content, kept up to date as
+        # later edits shift or overlap them
+        spans: list[tuple[int, int]] = []
+        for i, edit in enumerate(edits, 1):
+            if not isinstance(edit, dict) or not isinstance(
+                edit.get("old_str"), str
+            ):
+                raise ToolError(
+                    f"Invalid edit {i} in `edits`. Each edit should be an object with an `old_str` and an optional `new_str`. No edits were applied."
+                )
+            old_str = edit["old_str"].expandtabs()
+            new_str = (edit.get("new_str") or "").expandtabs()
+            try:
+                offset = self._find_unique(path, new_file_content, old_str)
+            except ToolError as e:
+                raise ToolError(
+                    f"Edit {i} of {len(edits)} failed, no edits were applied. {e.message}"
+                ) from None
+
+            old_end = offset + len(old_str)
+            new_end = offset + len(new_str)
+            shift = len(new_str) - len(old_str)
+            new_file_content = (
+                new_file_content[:offset] + new_str + new_file_content[old_end:]
+            )
+
+            edited = (offset, new_end)
+            shifted = []
+            for start, end in spans:
+                if end <= offset:
+                    shifted.append((start, end))
+                elif start >= old_end:
+                    shifted.append((start + shift, end + shift))
+                else:
+                    edited = (
+                        min(edited[0], start),
+                        max(edited[1], end + shift),
+                    )
+            spans = shifted + [edited]
+
+        await self.write_file(path, new_file_content)
+        self._file_history.push(path, file_content)
+
+        success_msg = f"The file {path} has been edited with {len(edits)} replacements. "
+        success_msg += self._make_snippets_output(new_file_content, spans, str(path))
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
+    def _find_unique(self, path: Path, file_content: str, old_str: str) -> int:
+        """Return the offset of the only occurrence of old_str in file_content; raise a ToolError if it is missing or not unique."""
+        offset = file_content.find(old_str)
+        if offset == -1:
+            raise ToolError(
+                f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
+            )
+        # Resume after the match, as str.count does, so overlapping matches
+        # don't count as duplicates
+        if file_content.find(old_str, offset + max(len(old_str), 1)) != -1:
+            lines = [
+                idx + 1
+                for idx, line in enumerate(file_content.split("\n"))
+                if old_str in line
+            ]
+            raise ToolError(
+                f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+            )
+        return offset
+
+    def _make_snippets_output(
+        self,
+        file_content: str,
+        spans: list[tuple[int, int]],
+        file_descriptor: str,
+    ):
+        """Generate output showing SNIPPET_LINES lines of context around each (start, end) span of file_content, merging snippets that touch."""
+        snippets: list[list[int]] = []
+        line, pos = 0, 0
+        for start, end in sorted(spans):
+            snippet_start = start
+            for _ in range(SNIPPET_LINES + 1):
+                snippet_start = file_content.rfind("\n", 0, snippet_start)
+                if snippet_start == -1:
+                    break
+            snippet_start += 1
+
+            snippet_end = end
+            for _ in range(SNIPPET_LINES + 1):
+                snippet_end = file_content.find("\n", snippet_end)
+                if snippet_end == -1:
+                    snippet_end = len(file_content)
+                    break
+                snippet_end += 1
+            else:
+                snippet_end -= 1
+
+            if snippets and snippet_start <= snippets[-1][1] + 1:
+                snippets[-1][1] = max(snippets[-1][1], snippet_end)
+                continue
+            line += file_content.count("\n", pos, snippet_start)
+            pos = snippet_start
+            snippets.append([snippet_start, snippet_end, line])
+
+        return "".join(
+            self._make_output(
+                file_content[start:end], f"a snippet of {file_descriptor}", line + 1
+            )
+            for start, end, line in snippets
+        )
+
+    async def insert(self, path: Path, insert_line: int, new_str: str):
         """Implement the insert command, which inserts new_str at the specified line in the file content."""
-        file_text = self.read_file(path).expandtabs()
+        file_text = (await self.read_file(path)).expandtabs()
         new_str = new_str.expandtabs()
         file_text_lines = file_text.split("\n")
         n_lines_file = len(file_text_lines)
@@ -226,8 +352,8 @@ class EditTool20250124(BaseAnthropicTool):
         new_file_text = "\n".join(new_file_text_lines)
         snippet = "\n".join(snippet_lines)
 
-        self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        await self.write_file(path, new_file_text)
+        self._file_history.push(path, file_text)
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -238,29 +364,29 @@ class EditTool20250124(BaseAnthropicTool):
         success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
         return CLIResult(output=success_msg)
 
-    def undo_edit(self, path: Path):
+    async def undo_edit(self, path: Path):
         """Implement the undo_edit command."""
-        if not self._file_history[path]:
+        old_text = self._file_history.pop(path)
+        if old_text is None:
             raise ToolError(f"No edit history found for {path}.")
 
-        old_text = self._file_history[path].pop()
-        self.write_file(path, old_text)
+        await self.write_file(path, old_text)
 
         return CLIResult(
             output=f"Last edit to {path} undone successfully. {self._make_output(old_text, str(path))}"
         )
 
-    def read_file(self, path: Path):
+    async def read_file(self, path: Path):
         """Read the content of a file from a given path; raise a ToolError if an error occurs."""
         try:
-            return path.read_text()
+            return await run_io(path.read_text)
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
-    def write_file(self, path: Path, file: str):
+    async def write_file(self, path: Path, file: str):
         """Write the content of a file to a given path; raise a ToolError if an error occurs."""
         try:
-            path.write_text(file)
+            await run_io(atomic_write_text, path, file)
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
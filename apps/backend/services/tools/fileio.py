@@ -0,0 +1,301 @@
+"""File access helpers for the edit tool."""
+
+import asyncio
+import codecs
+import functools
+import locale
+import mmap
+import os
+import stat
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import accumulate, count, islice
+from operator import add
+from pathlib import Path
+from typing import Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+MAX_IO_WORKERS: int = 4
+
+LINE_INDEX_STRIDE: int = 256
+LINE_INDEX_CHUNK: int = 4 * 1024 * 1024
+LINE_INDEX_CACHE_SIZE: int = 32
+
+MAX_LISTING_ENTRIES: int = 1000
+LISTING_CACHE_SIZE: int = 64
+# Directories modified this recently may change again within their mtime
+# granularity without the mtime moving, so their listings aren't cached
+LISTING_RACY_NS: int = 2_000_000_000
+
+# The encoding Path.read_text uses; newline offsets are only meaningful for
+# ASCII-compatible encodings that never embed b"\n" in other characters
+ENCODING: str = codecs.lookup(locale.getpreferredencoding(False)).name
+
+# Read once at import; os.umask can only be queried by setting it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+_io_executor = ThreadPoolExecutor(
+    max_workers=MAX_IO_WORKERS, thread_name_prefix="edit-tool-io"
+)
+
+
+async def run_io(func: Callable[..., T], *args) -> T:
+    """Run blocking file I/O on a bounded thread pool, off the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _io_executor, functools.partial(func, *args)
+    )
+
+
+def atomic_write_text(path: Path, text: str):
+    """Write `text` to `path` through a temporary file and a rename.
+
+    Readers see either the old or the new content, never a partial write.
+    Symlinks are written through, and the mode of an existing file is kept.
+    """
+    target = Path(os.path.realpath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o666 & ~_UMASK)
+        else:
+            os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+            try:
+                os.chown(tmp_path, st.st_uid, st.st_gid)
+            except PermissionError:
+                pass
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class LineIndex:
+    """Sparse index of line start offsets in a file.
+
+    The byte offset of every `LINE_INDEX_STRIDE`-th line is kept, so locating
+    a line needs at most `LINE_INDEX_STRIDE - 1` newline searches from the
+    nearest checkpoint. Line numbering matches `read_text().split("\\n")`.
+    """
+
+    def __init__(self, checkpoints: array, n_lines: int, size: int):
+        self._checkpoints = checkpoints
+        self.n_lines = n_lines
+        self.size = size
+
+    @classmethod
+    def build(cls, mm: mmap.mmap | bytes) -> "LineIndex | None":
+        """Index `mm`, or return None if its line breaks need translation."""
+        checkpoints = array("q", [0])
+        newlines = 0
+        for pos in range(0, len(mm), LINE_INDEX_CHUNK):
+            chunk = mm[pos : pos + LINE_INDEX_CHUNK]
+            # Text mode turns lone "\r" into line breaks; bytes can't follow
+            if chunk.count(b"\r") != chunk.count(b"\r\n"):
+                return None
+            parts = chunk.split(b"\n")
+            # Start offsets of the lines following each newline in the chunk
+            starts = map(add, accumulate(map(len, parts[:-1])), count(pos + 1))
+            first = -(newlines + 1) % LINE_INDEX_STRIDE
+            checkpoints.extend(islice(starts, first, None, LINE_INDEX_STRIDE))
+            newlines += len(parts) - 1
+        return cls(checkpoints, newlines + 1, len(mm))
+
+    def line_start(self, mm: mmap.mmap | bytes, line: int) -> int:
+        """Byte offset at which 1-based `line` starts."""
+        checkpoint, remaining = divmod(line - 1, LINE_INDEX_STRIDE)
+        offset = self._checkpoints[checkpoint]
+        for _ in range(remaining):
+            offset = mm.find(b"\n", offset) + 1
+        return offset
+
+    def read_lines(
+        self,
+        mm: mmap.mmap | bytes,
+        init_line: int,
+        final_line: int,
+        max_chars: int | None = None,
+    ) -> str:
+        """Decode lines `init_line` to `final_line` (inclusive, -1 for EOF).
+
+        With `max_chars`, decoding stops once more than `max_chars`
+        characters are guaranteed, so callers that truncate their output
+        never decode the rest of a huge range.
+        """
+        start = self.line_start(mm, init_line)
+        if final_line == -1 or final_line >= self.n_lines:
+            end = self.size
+        else:
+            end = mm.find(b"\n", self.line_start(mm, final_line))
+            if mm[end - 1 : end] == b"\r" and end > start:
+                end -= 1
+        # A character is at most 4 bytes, plus slack for a split sequence
+        clipped = max_chars is not None and end - start > 4 * max_chars + 8
+        if clipped:
+            end = start + 4 * max_chars + 8
+        decoder = codecs.getincrementaldecoder(ENCODING)()
+        text = decoder.decode(mm[start:end], final=not clipped)
+        # Match the newline translation done by Path.read_text
+        return text.replace("\r\n", "\n")
+
+
+_line_indexes: OrderedDict[tuple[Path, int, int], LineIndex | None] = (
+    OrderedDict()
+)
+_line_indexes_lock = threading.Lock()
+
+
+class MappedLines:
+    """A file mapped into memory together with its (cached) line index.
+
+    Line indexes are cached by path, modification time and size, so repeated
+    ranged views of an unchanged file skip straight to the requested lines.
+    """
+
+    def __init__(self, mm: mmap.mmap, index: LineIndex):
+        self._mm = mm
+        self._index = index
+
+    @property
+    def n_lines(self) -> int:
+        return self._index.n_lines
+
+    def read(
+        self, init_line: int, final_line: int, max_chars: int | None = None
+    ) -> str:
+        return self._index.read_lines(
+            self._mm, init_line, final_line, max_chars
+        )
+
+    @classmethod
+    @contextmanager
+    def open(cls, path: Path) -> Iterator["MappedLines | None"]:
+        """Map `path`, yielding None if it is empty or can't be indexed."""
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if not st.st_size or ENCODING not in ("utf-8", "ascii"):
+                yield None
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                index = _get_line_index(path, st, mm)
+                yield cls(mm, index) if index is not None else None
+
+
+def _get_line_index(
+    path: Path, st: os.stat_result, mm: mmap.mmap
+) -> LineIndex | None:
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _line_indexes_lock:
+        if key in _line_indexes:
+            _line_indexes.move_to_end(key)
+            return _line_indexes[key]
+
+    index = LineIndex.build(mm)
+    with _line_indexes_lock:
+        _line_indexes[key] = index
+        while len(_line_indexes) > LINE_INDEX_CACHE_SIZE:
+            _line_indexes.popitem(last=False)
+    return index
+
+
+@dataclass(frozen=True)
+class _Listing:
+    output: str
+    error: str
+    mtimes: tuple[tuple[str, int], ...]
+
+    def is_fresh(self) -> bool:
+        try:
+            return all(
+                os.stat(directory).st_mtime_ns == mtime
+                for directory, mtime in self.mtimes
+            )
+        except OSError:
+            return False
+
+
+_listings: OrderedDict[tuple[Path, int], _Listing] = OrderedDict()
+_listings_lock = threading.Lock()
+
+
+def list_directory(path: Path, max_depth: int = 2) -> tuple[str, str]:
+    """List the non-hidden entries under `path` up to `max_depth` levels deep.
+
+    The output matches `find {path} -maxdepth {max_depth} -not -path '*/\\.*'`:
+    one path per line, parents before their children. At most
+    `MAX_LISTING_ENTRIES` entries are listed. Listings are cached and reused
+    for as long as the modification times of the directories read stay the
+    same. Returns the listing and any errors hit while reading directories.
+    """
+    key = (path, max_depth)
+    with _listings_lock:
+        listing = _listings.get(key)
+    if listing is not None and listing.is_fresh():
+        with _listings_lock:
+            if key in _listings:
+                _listings.move_to_end(key)
+        return listing.output, listing.error
+
+    listing = _walk(path, max_depth)
+    newest = max((mtime for _, mtime in listing.mtimes), default=0)
+    if time.time_ns() - newest > LISTING_RACY_NS:
+        with _listings_lock:
+            _listings[key] = listing
+            while len(_listings) > LISTING_CACHE_SIZE:
+                _listings.popitem(last=False)
+    return listing.output, listing.error
+
+
+def _walk(path: Path, max_depth: int) -> _Listing:
+    entries = [str(path)]
+    errors: list[str] = []
+    mtimes: list[tuple[str, int]] = []
+
+    def walk(directory: str, depth: int) -> bool:
+        """Walk `directory`; return False once the entry limit is reached."""
+        try:
+            mtimes.append((directory, os.stat(directory).st_mtime_ns))
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if len(entries) > MAX_LISTING_ENTRIES:
+                        return False
+                    entries.append(entry.path)
+                    if depth < max_depth and entry.is_dir(
+                        follow_symlinks=False
+                    ):
+                        if not walk(entry.path, depth + 1):
+                            return False
+        except OSError as e:
+            errors.append(f"Cannot read directory '{directory}': {e.strerror}")
+        return True
+
+    if not walk(str(path), 1):
+        entries.append(
+            f"<listing truncated after {MAX_LISTING_ENTRIES} entries>"
+        )
+    return _Listing(
+        output="\n".join(entries) + "\n",
+        error="\n".join(errors),
+        mtimes=tuple(mtimes),
+    )
@@ -0,0 +1,166 @@
+"""Compact undo history for the edit tool.
+
+Every file keeps a stack of previous versions. Only the top of the stack is
+stored as a (compressed) snapshot; each older version is stored as a reverse
+delta against the version above it, so a long run of small edits to a large
+file costs little more than one compressed copy of that file.
+"""
+
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+MAX_FILE_HISTORY_BYTES: int = 8 * 1024 * 1024
+MAX_HISTORY_BYTES: int = 64 * 1024 * 1024
+COMPRESSION_LEVEL: int = 1
+
+
+def _compress(text: str) -> bytes:
+    return zlib.compress(text.encode(), COMPRESSION_LEVEL)
+
+
+def _decompress(data: bytes) -> str:
+    return zlib.decompress(data).decode()
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    """Length of the common prefix of `a` and `b`, found by bisecting slices."""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_len(a: str, b: str, limit: int) -> int:
+    """Length of the common suffix of `a` and `b`, capped at `limit`."""
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid : len(a) - lo] == b[len(b) - mid : len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+@dataclass(frozen=True)
+class _Delta:
+    """Rebuilds an older text from the newer text it was taken against."""
+
+    prefix: int
+    suffix: int
+    middle: bytes
+
+    @classmethod
+    def between(cls, newer: str, older: str) -> "_Delta":
+        prefix = _common_prefix_len(newer, older)
+        suffix = _common_suffix_len(
+            newer, older, min(len(newer), len(older)) - prefix
+        )
+        return cls(
+            prefix=prefix,
+            suffix=suffix,
+            middle=_compress(older[prefix : len(older) - suffix]),
+        )
+
+    def apply(self, newer: str) -> str:
+        return (
+            newer[: self.prefix]
+            + _decompress(self.middle)
+            + newer[len(newer) - self.suffix :]
+        )
+
+    @property
+    def size(self) -> int:
+        return len(self.middle)
+
+
+@dataclass
+class _PathHistory:
+    head: bytes
+    deltas: list[_Delta] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return len(self.head) + sum(delta.size for delta in self.deltas)
+
+
+class FileHistory:
+    """Per-file undo stacks with per-file and global byte budgets.
+
+    When a budget is exceeded the oldest versions are dropped first, starting
+    with the least recently edited file. The latest version of the file just
+    edited is always kept, even over budget, so the last edit can be undone.
+    """
+
+    def __init__(
+        self,
+        max_file_bytes: int = MAX_FILE_HISTORY_BYTES,
+        max_total_bytes: int = MAX_HISTORY_BYTES,
+    ):
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self._histories: OrderedDict[Path, _PathHistory] = OrderedDict()
+        self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self._histories
+
+    def __len__(self) -> int:
+        return sum(
+            len(history.deltas) + 1 for history in self._histories.values()
+        )
+
+    def push(self, path: Path, text: str):
+        """Record `text` as the most recent version of `path`."""
+        history = self._histories.pop(path, None)
+        if history is None:
+            history = _PathHistory(head=_compress(text))
+        else:
+            self._total_bytes -= history.size
+            history.deltas.append(
+                _Delta.between(newer=text, older=_decompress(history.head))
+            )
+            history.head = _compress(text)
+
+        while history.deltas and history.size > self.max_file_bytes:
+            history.deltas.pop(0)
+
+        self._histories[path] = history
+        self._total_bytes += history.size
+        self._evict()
+
+    def pop(self, path: Path) -> str | None:
+        """Remove and return the most recent version of `path`, if any."""
+        history = self._histories.pop(path, None)
+        if history is None:
+            return None
+        self._total_bytes -= history.size
+
+        text = _decompress(history.head)
+        if history.deltas:
+            history.head = _compress(history.deltas.pop().apply(text))
+            self._histories[path] = history
+            self._total_bytes += history.size
+        return text
+
+    def _evict(self):
+        while self._total_bytes > self.max_total_bytes:
+            path, history = next(iter(self._histories.items()))
+            if len(self._histories) == 1 and not history.deltas:
+                break
+            self._total_bytes -= history.size
+            if history.deltas:
+                history.deltas.pop(0)
+                self._total_bytes += history.size
+            else:
+                del self._histories[path]
@@ -0,0 +1,429 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from config import settings
+from models.base import FileMetadata, ResumableUpload
+from services.file import FileService, UploadTooLargeError
+from utils.database import db
+from utils.uploads import INCOMING_DIR, hash_file, incoming_path
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps for expired uploads
+_EXPIRE_INTERVAL = 60 * 60
+
+
+class UploadRangeError(Exception):
+    """Raised when a chunk doesn't fit the upload or its declared range."""
+
+
+class UploadIncompleteError(Exception):
+    """Raised when completing an upload that is missing bytes."""
+
+
+class UploadBusyError(Exception):
+    """Raised when an upload is being completed or receiving a chunk."""
+
+
+class ChecksumMismatchError(Exception):
+    """Raised when a completed upload doesn't match its expected SHA-256."""
+
+
+def _merge_range(
+    ranges: list[list[int]], start: int, end: int
+) -> list[list[int]]:
+    """Add [start, end) to sorted, disjoint ranges, merging where they touch"""
+    merged = []
+    for r_start, r_end in ranges:
+        if r_end < start or r_start > end:
+            merged.append([r_start, r_end])
+        else:
+            start, end = min(start, r_start), max(end, r_end)
+    merged.append([start, end])
+    return sorted(merged)
+
+
+def _create_part(path: str, size: int) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.truncate(size)
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _stale_parts(cutoff: float) -> list[str]:
+    """IDs of the partial files not modified since `cutoff`"""
+    if not os.path.isdir(INCOMING_DIR):
+        return []
+    return [
+        entry.name.removesuffix(".part")
+        for entry in os.scandir(INCOMING_DIR)
+        if entry.name.endswith(".part") and entry.stat().st_mtime < cutoff
+    ]
+
+
+def _to_upload(row) -> ResumableUpload:
+    return ResumableUpload(
+        id=row["id"],
+        filename=row["filename"],
+        mime_type=row["mime_type"],
+        size=row["size"],
+        session_id=row["session_id"],
+        sha256=row["sha256"],
+        received=json.loads(row["received"]),
+        received_bytes=row["received_bytes"],
+        created_at=row["created_at"],
+        updated_at=row["updated_at"],
+    )
+
+
+class UploadService:
+    """Resumable uploads, sent as byte ranges in any order.
+
+    Each upload is assembled in a partial file of its full size, written in
+    place as chunks arrive, so nothing is buffered in memory and a dropped
+    connection only loses the chunk in flight. The ranges received so far
+    are recorded with the upload. Once every byte is in, completing the
+    upload checks its checksum and stores it like any other file.
+    """
+
+    # Uploads being completed, which no longer accept chunks
+    _completing: set[str] = set()
+    # Number of chunks being written to each upload's partial file
+    _writers: dict[str, int] = {}
+
+    @staticmethod
+    def _check_idle(upload_id: str) -> None:
+        """Raise UploadBusyError if the upload is being completed or written to
+
+        The partial file becomes the stored file once the upload is
+        completed, so no chunk may still be writing to it by then.
+        """
+        if upload_id in UploadService._completing:
+            raise UploadBusyError("Upload is being completed")
+        if UploadService._writers.get(upload_id):
+            raise UploadBusyError("Upload is receiving a chunk")
+
+    @staticmethod
+    async def create_upload(
+        filename: str,
+        size: int,
+        session_id: str,
+        mime_type: Optional[str] = None,
+        sha256: Optional[str] = None,
+    ) -> ResumableUpload:
+        """Start a resumable upload.
+
+        Args:
+            filename: The name of the file being uploaded
+            size: The file's size in bytes
+            session_id: Session to associate the file with
+            mime_type: The file's content type
+            sha256: The expected SHA-256 hex digest of the file, if known
+
+        Returns:
+            ResumableUpload: The new upload, with nothing received
+
+        Raises:
+            UploadTooLargeError: If `size` is over MAX_UPLOAD_SIZE
+        """
+        if size > settings.MAX_UPLOAD_SIZE:
+            raise UploadTooLargeError(
+                f"File is larger than {settings.MAX_UPLOAD_SIZE} bytes"
+            )
+
+        upload_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        upload = ResumableUpload(
+            id=upload_id,
+            filename=filename,
+            mime_type=mime_type or "application/octet-stream",
+            size=size,
+            session_id=session_id,
+            sha256=sha256.lower() if sha256 else None,
+            created_at=now,
+            updated_at=now,
+        )
+        path = incoming_path(upload_id)
+        await asyncio.to_thread(_create_part, path, size)
+        try:
+            await db.execute(
+                """
+                INSERT INTO uploads (id, filename, mime_type, size, sha256, session_id, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    upload.id,
+                    upload.filename,
+                    upload.mime_type,
+                    upload.size,
+                    upload.sha256,
+                    upload.session_id,
+                    now,
+                    now,
+                ),
+            )
+        except BaseException:
+            await asyncio.to_thread(_remove_quietly, path)
+            raise
+        return upload
+
+    @staticmethod
+    async def get_upload(upload_id: str) -> Optional[ResumableUpload]:
+        """Get an upload and the ranges received so far."""
+        row = await db.fetch_one(
+            "SELECT * FROM uploads WHERE id = ?", (upload_id,)
+        )
+        return _to_upload(row) if row else None
+
+    @staticmethod
+    async def write_range(
+        upload_id: str, start: int, end: int, body: AsyncIterator[bytes]
+    ) -> Optional[ResumableUpload]:
+        """Write the bytes [start, end) of an upload from a streamed body.
+
+        Chunks may arrive in any order and may overlap; bytes sent again
+        overwrite what was there. The range only counts as received once
+        the whole body has been written.
+
+        Args:
+            upload_id: The ID of the upload
+            start: Offset of the first byte in the body
+            end: Offset just past the last byte in the body
+            body: The chunk's bytes
+
+        Returns:
+            ResumableUpload: The upload with the range received, or None if
+                the upload doesn't exist
+
+        Raises:
+            UploadRangeError: If the range is outside the file, or the body
+                isn't exactly `end - start` bytes long
+            UploadBusyError: If the upload is being completed
+        """
+        upload = await UploadService.get_upload(upload_id)
+        if upload is None:
+            return None
+        if upload_id in UploadService._completing:
+            raise UploadBusyError("Upload is being completed")
+        if not 0 <= start < end <= upload.size:
+            raise UploadRangeError(
+                f"Range {start}-{end - 1} is outside the file's "
+                f"{upload.size} bytes"
+            )
+
+        # Counted until the range is recorded, so the upload can't be
+        # completed or cancelled while this chunk is still landing
+        writers = UploadService._writers
+        writers[upload_id] = writers.get(upload_id, 0) + 1
+        try:
+            offset = await UploadService._write_body(
+                upload_id, start, end, body
+            )
+            if offset is None:
+                # Cancelled or expired since it was looked up
+                return None
+            if offset != end:
+                raise UploadRangeError("Body is shorter than its range")
+            if not await UploadService._record_range(upload_id, start, end):
+                return None
+        finally:
+            writers[upload_id] -= 1
+            if not writers[upload_id]:
+                del writers[upload_id]
+        return await UploadService.get_upload(upload_id)
+
+    @staticmethod
+    async def _record_range(upload_id: str, start: int, end: int) -> bool:
+        """Mark [start, end) as received; False if the upload is gone"""
+        async with db.transaction() as conn:
+            async with conn.execute(
+                "SELECT received FROM uploads WHERE id = ?", (upload_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                return False
+            received = _merge_range(json.loads(row["received"]), start, end)
+            await conn.execute(
+                """
+                UPDATE uploads
+                SET received = ?, received_bytes = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (
+                    json.dumps(received),
+                    sum(r_end - r_start for r_start, r_end in received),
+                    datetime.utcnow(),
+                    upload_id,
+                ),
+            )
+        return True
+
+    @staticmethod
+    async def _write_body(
+        upload_id: str, start: int, end: int, body: AsyncIterator[bytes]
+    ) -> Optional[int]:
+        """Write a chunk's body to the partial file from `start`.
+
+        Returns:
+            int: The offset just past the last byte written, or None if the
+                partial file is gone
+        """
+        try:
+            fd = await asyncio.to_thread(
+                os.open, incoming_path(upload_id), os.O_WRONLY
+            )
+        except FileNotFoundError:
+            return None
+        offset = start
+        try:
+            async for chunk in body:
+                if offset + len(chunk) > end:
+                    raise UploadRangeError("Body is longer than its range")
+                if upload_id in UploadService._completing:
+                    raise UploadBusyError("Upload is being completed")
+                await asyncio.to_thread(os.pwrite, fd, chunk, offset)
+                offset += len(chunk)
+        finally:
+            await asyncio.to_thread(os.close, fd)
+        return offset
+
+    @staticmethod
+    async def complete_upload(
+        upload_id: str, sha256: Optional[str] = None
+    ) -> Optional[FileMetadata]:
+        """Turn a fully received upload into a file.
+
+        Args:
+            upload_id: The ID of the upload
+            sha256: The expected SHA-256 hex digest, overriding any given
+                when the upload was created
+
+        Returns:
+            FileMetadata: The new file's metadata, or None if the upload
+                doesn't exist
+
+        Raises:
+            UploadIncompleteError: If some bytes haven't been received
+            ChecksumMismatchError: If the file doesn't match the expected
+                digest; the upload is kept so bad ranges can be sent again
+            UploadBusyError: If the upload is already being completed, or
+                a chunk is still being written to it
+        """
+        UploadService._check_idle(upload_id)
+        UploadService._completing.add(upload_id)
+        try:
+            upload = await UploadService.get_upload(upload_id)
+            if upload is None:
+                return None
+            if upload.received_bytes != upload.size:
+                raise UploadIncompleteError(
+                    f"Received {upload.received_bytes} of {upload.size} bytes"
+                )
+
+            path = incoming_path(upload_id)
+            digest = await asyncio.to_thread(hash_file, path)
+            expected = (sha256 or upload.sha256 or digest).lower()
+            if digest != expected:
+                raise ChecksumMismatchError(
+                    f"SHA-256 is {digest}, expected {expected}"
+                )
+
+            return await FileService.store_file(
+                path,
+                upload.filename,
+                upload.mime_type,
+                upload.size,
+                digest,
+                upload.session_id,
+                writes=[("DELETE FROM uploads WHERE id = ?", (upload_id,))],
+            )
+        finally:
+            UploadService._completing.discard(upload_id)
+
+    @staticmethod
+    async def cancel_upload(upload_id: str) -> bool:
+        """Discard an upload and what it has received.
+
+        Returns:
+            bool: True if the upload existed and was discarded
+
+        Raises:
+            UploadBusyError: If the upload is being completed, or a chunk is
+                being written to it
+        """
+        UploadService._check_idle(upload_id)
+        if not await db.execute(
+            "DELETE FROM uploads WHERE id = ?", (upload_id,)
+        ):
+            return False
+        await asyncio.to_thread(_remove_quietly, incoming_path(upload_id))
+        return True
+
+    @staticmethod
+    async def remove_parts(upload_ids: list[str]) -> None:
+        """Remove the partial files of uploads that no longer exist"""
+        for upload_id in upload_ids:
+            await asyncio.to_thread(_remove_quietly, incoming_path(upload_id))
+
+    @staticmethod
+    async def expire_uploads(
+        expire_after: float = settings.UPLOAD_EXPIRE_AFTER,
+    ) -> int:
+        """Discard uploads that have had no chunk for `expire_after` seconds.
+
+        Returns:
+            int: The number of uploads discarded
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=expire_after)
+        rows = await db.fetch_all(
+            "SELECT id FROM uploads WHERE updated_at < ?", (cutoff,)
+        )
+        expired = 0
+        for row in rows:
+            if (
+                row["id"] in UploadService._completing
+                or row["id"] in UploadService._writers
+            ):
+                continue
+            if await UploadService.cancel_upload(row["id"]):
+                expired += 1
+
+        # Partial files left behind by a crash, with no upload to go with
+        ids = await asyncio.to_thread(_stale_parts, cutoff.timestamp())
+        if ids:
+            placeholders = ", ".join("?" * len(ids))
+            known = {
+                row["id"]
+                for row in await db.fetch_all(
+                    f"SELECT id FROM uploads WHERE id IN ({placeholders})",
+                    ids,
+                )
+            }
+            await UploadService.remove_parts(
+                [upload_id for upload_id in ids if upload_id not in known]
+            )
+
+        if expired:
+            logger.info(f"Discarded {expired} expired uploads")
+        return expired
+
+    @staticmethod
+    async def run(interval: float = _EXPIRE_INTERVAL) -> None:
+        """Discard expired uploads every `interval` seconds, until cancelled"""
+        while True:
+            try:
+                await UploadService.expire_uploads()
+            except Exception:
+                logger.exception("Failed to discard expired uploads")
+            await asyncio.sleep(interval)
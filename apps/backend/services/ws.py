@@ -1,18 +1,199 @@
+import asyncio
 import json
-from typing import Dict, Set
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, Optional, Set
 
+from config import settings
 from fastapi import WebSocket
 from starlette.websockets import WebSocketDisconnect
+from utils.tasks import start_background_task
+
+logger = logging.getLogger(__name__)
+
+# Close code for clients dropped for falling behind ("Try Again Later")
+SLOW_CLIENT_CLOSE_CODE = 1013
+
+# (sequence number, coalesce key, message text)
+Event = tuple[int, Optional[str], str]
+
+
+class _EventLog:
+    """The most recent events broadcast to a session, for replay.
+
+    Sequence numbers start from the current time in microseconds, so they
+    keep increasing across restarts and a client's last-seen number from
+    before one is never mistaken for a recent event.
+    """
+
+    def __init__(self, size: int):
+        self.events: deque[Event] = deque(maxlen=size)
+        self.last_seq = time.time_ns() // 1000
+
+    def append(self, message: dict, coalesce_key: Optional[str]) -> Event:
+        self.last_seq += 1
+        event = (
+            self.last_seq,
+            coalesce_key,
+            json.dumps({**message, "seq": self.last_seq}),
+        )
+        self.events.append(event)
+        return event
+
+    def since(self, last_seq: int) -> Optional[list[Event]]:
+        """Events after `last_seq`, or None if some are no longer kept"""
+        first_seq = self.events[0][0] if self.events else self.last_seq + 1
+        if not first_seq - 1 <= last_seq <= self.last_seq:
+            return None
+        return [event for event in self.events if event[0] > last_seq]
+
+
+def _latest(events: list[Event]) -> Iterable[Event]:
+    """Skip events superseded by a later event with the same coalesce key"""
+    later_keys = set()
+    kept = []
+    for event in reversed(events):
+        key = event[1]
+        if key is not None:
+            if key in later_keys:
+                continue
+            later_keys.add(key)
+        kept.append(event)
+    return reversed(kept)
+
+
+class _Connection:
+    """A client connection with a bounded queue of outgoing messages.
+
+    Messages are sent by the connection's own writer task, so a slow client
+    only holds up itself. Messages with a coalesce key supersede any queued
+    message with the same key, and are the first to be dropped when the
+    queue is full. A client whose queue is full of messages that can't be
+    dropped, or that doesn't accept a message within the send timeout, is
+    disconnected.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_queue: int = settings.WS_SEND_QUEUE_SIZE,
+        send_timeout: float = settings.WS_SEND_TIMEOUT,
+    ):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        # (coalesce key, message text) pairs, oldest first
+        self.queue: deque[tuple[Optional[str], str]] = deque()
+        self.ready = asyncio.Event()
+        self.ready.set()
+        self.closing = False
+        self.writer: Optional[asyncio.Task] = None
+
+    def replay(self, events: Iterable[Event]) -> None:
+        """Queue missed events ahead of new ones, ignoring the size limit"""
+        self.queue.extend((key, text) for _, key, text in events)
+
+    def enqueue(self, text: str, coalesce_key: Optional[str] = None) -> bool:
+        """Queue a message without waiting.
+
+        Returns:
+            bool: False if the client is too far behind and should be
+                disconnected
+        """
+        if self.closing:
+            return True
+        if coalesce_key is not None:
+            for i, (key, _) in enumerate(self.queue):
+                if key == coalesce_key:
+                    del self.queue[i]
+                    break
+        if len(self.queue) >= self.max_queue:
+            for i, (key, _) in enumerate(self.queue):
+                if key is not None:
+                    del self.queue[i]
+                    break
+            else:
+                return False
+        self.queue.append((coalesce_key, text))
+        self.ready.set()
+        return True
+
+    async def write(self) -> None:
+        """Send queued messages until the connection fails or is closed"""
+        while True:
+            await self.ready.wait()
+            while self.queue:
+                _, text = self.queue.popleft()
+                await asyncio.wait_for(
+                    self.websocket.send_text(text), self.send_timeout
+                )
+            self.ready.clear()
+
+    async def close(self, code: int) -> None:
+        self.closing = True
+        self.queue.clear()
+        try:
+            await asyncio.wait_for(
+                self.websocket.close(code=code), self.send_timeout
+            )
+        except (WebSocketDisconnect, RuntimeError, asyncio.TimeoutError):
+            pass
 
 
 class WebSocketManager:
     def __init__(self):
         # Map of session_id to set of connected WebSocket clients
         self.active_connections: Dict[str, Set[WebSocket]] = {}
+        self._connections: Dict[WebSocket, _Connection] = {}
+        # Recent events per session, least recently used first
+        self._logs: OrderedDict[str, _EventLog] = OrderedDict()
+
+    def _log(self, session_id: str) -> _EventLog:
+        log = self._logs.get(session_id)
+        if log is None:
+            log = self._logs[session_id] = _EventLog(
+                settings.WS_REPLAY_BUFFER_SIZE
+            )
+            if len(self._logs) > settings.WS_REPLAY_SESSIONS:
+                self._logs.popitem(last=False)
+        self._logs.move_to_end(session_id)
+        return log
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        last_seq: Optional[int] = None,
+    ):
+        """Connect a new WebSocket client and start its writer task.
+
+        The client is first sent the events it missed since `last_seq`,
+        then a `sync` event with the latest sequence number. If the missed
+        events are no longer kept, it is sent a `resync` event instead, and
+        should refetch the session's messages.
 
-    async def connect(self, websocket: WebSocket, session_id: str):
-        """Connect a new WebSocket client"""
+        Args:
+            websocket: The client's connection
+            session_id: The session to subscribe to
+            last_seq: The `seq` of the last event the client received, if
+                it is reconnecting
+        """
         await websocket.accept()
+        connection = _Connection(websocket)
+        log = self._log(session_id)
+        missed = [] if last_seq is None else log.since(last_seq)
+        status = {
+            "type": "sync" if missed is not None else "resync",
+            "seq": log.last_seq,
+        }
+        connection.replay(_latest(missed or []))
+        connection.replay([(log.last_seq, None, json.dumps(status))])
+        connection.writer = asyncio.create_task(
+            self._run_writer(connection, session_id),
+            name=f"ws-writer-{session_id}",
+        )
+        self._connections[websocket] = connection
         if session_id not in self.active_connections:
             self.active_connections[session_id] = set()
         self.active_connections[session_id].add(websocket)
@@ -23,23 +204,68 @@ class WebSocketManager:
             self.active_connections[session_id].discard(websocket)
             if not self.active_connections[session_id]:
                 del self.active_connections[session_id]
+        connection = self._connections.pop(websocket, None)
+        if connection is not None and connection.writer is not None:
+            if connection.writer is not asyncio.current_task():
+                connection.writer.cancel()
+
+    async def _run_writer(self, connection: _Connection, session_id: str):
+        try:
+            await connection.write()
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"WebSocket client for session {session_id} is not "
+                "accepting messages; disconnecting"
+            )
+            self.disconnect(connection.websocket, session_id)
+            await connection.close(SLOW_CLIENT_CLOSE_CODE)
+        except (WebSocketDisconnect, RuntimeError) as e:
+            logger.info(f"WebSocket error for session {session_id}: {e}")
+            self.disconnect(connection.websocket, session_id)
 
-    async def broadcast_to_session(self, session_id: str, message: dict):
-        """Broadcast a message to all clients in a session"""
+    async def broadcast_to_session(
+        self,
+        session_id: str,
+        message: dict,
+        coalesce_key: Optional[str] = None,
+    ):
+        """Queue a message for every client in a session.
+
+        The message is sent with a `seq` field, numbering the session's
+        events in order, and kept in the session's replay buffer for clients
+        that reconnect. Returns as soon as the message is queued; each
+        client's writer task sends it. A client too far behind to take it is
+        disconnected.
+
+        Args:
+            session_id: The session whose clients receive the message
+            message: The message, sent as JSON
+            coalesce_key: Marks messages superseded by a later message with
+                the same key, such as progress updates; clients that fall
+                behind only get the latest
+        """
+        _, _, json_message = self._log(session_id).append(
+            message, coalesce_key
+        )
         if session_id not in self.active_connections:
             return
 
-        # Convert message to JSON string
-        json_message = json.dumps(message)
-
-        # Send to all connected clients for this session
-        for connection in self.active_connections[session_id]:
-            try:
-                await connection.send_text(json_message)
-            except (WebSocketDisconnect, RuntimeError) as e:
-                # Handle WebSocket disconnection and runtime errors
-                print(f"WebSocket error for session {session_id}: {str(e)}")
-                self.disconnect(connection, session_id)
+        # Copied, as slow clients are disconnected along the way
+        for websocket in list(self.active_connections[session_id]):
+            connection = self._connections.get(websocket)
+            if connection is None or connection.enqueue(
+                json_message, coalesce_key
+            ):
+                continue
+            logger.warning(
+                f"WebSocket client for session {session_id} fell "
+                f"{connection.max_queue} messages behind; disconnecting"
+            )
+            self.disconnect(websocket, session_id)
+            start_background_task(
+                connection.close(SLOW_CLIENT_CLOSE_CODE),
+                f"ws-close-{session_id}",
+            )
 
     async def broadcast_file_update(
         self, session_id: str, action: str, file_id: str
@@ -0,0 +1,64 @@
+"""Per-session archive files.
+
+An archive is a gzip-compressed JSON Lines file holding everything needed
+to restore a session's messages: one record for the session, then one per
+message and one per image blob its messages reference, so the archive stays
+readable even after the blobs are removed from the database:
+
+    {"type": "session", "id": ..., "archived_at": ...}
+    {"type": "message", "id": ..., "role": ..., "content": [...],
+     "message": ..., "created_at": ...}
+    {"type": "blob", "hash": ..., "media_type": ..., "data": "<base64>"}
+"""
+
+import gzip
+import json
+import os
+import tempfile
+from typing import Any, Iterable, Iterator
+
+from config import settings
+
+ARCHIVE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), settings.ARCHIVE_DIR
+)
+
+Record = dict[str, Any]
+
+
+def archive_path(session_id: str) -> str:
+    """Path of a session's archive file"""
+    return os.path.join(ARCHIVE_DIR, f"{session_id}.jsonl.gz")
+
+
+def write_archive(path: str, records: Iterable[Record]) -> int:
+    """Write records to an archive atomically; return its size in bytes.
+
+    The archive is written to a temporary file in the same directory and
+    moved into place once it is safely on disk, so `path` never holds a
+    partial archive.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+                for record in records:
+                    f.write(json.dumps(record).encode())
+                    f.write(b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+            size = raw.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return size
+
+
+def read_archive(path: str) -> Iterator[Record]:
+    """Read the records of an archive in order"""
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            yield json.loads(line)
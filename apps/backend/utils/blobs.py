@@ -0,0 +1,98 @@
+"""Moving inline base64 images out of message content blocks and back.
+
+Images are stored once in the `blobs` table, keyed by the SHA-256 of their
+bytes, and message content refers to them with a source of type "blob":
+
+    {"type": "image", "source": {"type": "blob", "media_type": "image/png",
+                                 "hash": "<sha256 hex digest>"}}
+"""
+
+import base64
+import hashlib
+from typing import Any, Callable
+
+Block = dict[str, Any]
+
+BLOB_SOURCE_TYPE = "blob"
+
+
+def _map_images(content: list[Block], func: Callable[[Block], Block]):
+    """Apply `func` to every image block, including those in tool results"""
+
+    def visit(block: Block) -> Block:
+        if not isinstance(block, dict):
+            return block
+        if block.get("type") == "image":
+            return func(block)
+        if block.get("type") == "tool_result" and isinstance(
+            block.get("content"), list
+        ):
+            return {**block, "content": [visit(b) for b in block["content"]]}
+        return block
+
+    return [visit(block) for block in content]
+
+
+def extract_blobs(
+    content: list[Block],
+) -> tuple[list[Block], dict[str, tuple[str, bytes]]]:
+    """Replace inline base64 images in `content` with blob references.
+
+    Returns the new content and the extracted images as
+    {hash: (media_type, data)}.
+    """
+    blobs: dict[str, tuple[str, bytes]] = {}
+
+    def extract(block: Block) -> Block:
+        source = block.get("source") or {}
+        if source.get("type") != "base64":
+            return block
+        data = base64.b64decode(source["data"])
+        digest = hashlib.sha256(data).hexdigest()
+        blobs[digest] = (source["media_type"], data)
+        return {
+            **block,
+            "source": {
+                "type": BLOB_SOURCE_TYPE,
+                "media_type": source["media_type"],
+                "hash": digest,
+            },
+        }
+
+    return _map_images(content, extract), blobs
+
+
+def blob_hashes(content: list[Block]) -> set[str]:
+    """Hashes of the blobs referenced by `content`"""
+    hashes: set[str] = set()
+
+    def collect(block: Block) -> Block:
+        source = block.get("source") or {}
+        if source.get("type") == BLOB_SOURCE_TYPE:
+            hashes.add(source["hash"])
+        return block
+
+    _map_images(content, collect)
+    return hashes
+
+
+def inline_blobs(content: list[Block], blobs: dict[str, bytes]) -> list[Block]:
+    """Replace blob references in `content` with inline base64 images.
+
+    References to blobs missing from `blobs` are left as they are.
+    """
+
+    def inline(block: Block) -> Block:
+        source = block.get("source") or {}
+        if source.get("type") != BLOB_SOURCE_TYPE or source["hash"] not in blobs:
+            return block
+        return {
+            **block,
+            "source": {
+                "type": "base64",
+                "media_type": source["media_type"],
+                "data": base64.b64encode(blobs[source["hash"]]).decode(),
+            },
+        }
+
+    return _map_images(content, inline)
@@ -0,0 +1,46 @@
+"""Compressed storage for message content.
+
+Message content is JSON text. When compression is enabled, content of at
+least `MESSAGE_COMPRESSION_MIN_SIZE` characters is stored as a BLOB holding
+`MARKER` followed by the zlib-compressed UTF-8 JSON. Anything else,
+including rows written before compression existed, is stored as plain
+TEXT, and `decode_content` reads both formats.
+"""
+
+import zlib
+
+from config import settings
+
+# Format marker at the start of compressed values. JSON text never starts
+# with a NUL byte, so it can't be mistaken for uncompressed content
+MARKER = b"\x00z1"
+
+
+def compress_content(text: str) -> bytes | None:
+    """Compress JSON text, or return None if that doesn't make it smaller"""
+    data = text.encode()
+    compressed = MARKER + zlib.compress(
+        data, settings.MESSAGE_COMPRESSION_LEVEL
+    )
+    if len(compressed) >= len(data):
+        return None
+    return compressed
+
+
+def encode_content(text: str) -> str | bytes:
+    """Return the value to store for JSON text, per the compression settings"""
+    if (
+        not settings.MESSAGE_COMPRESSION
+        or len(text) < settings.MESSAGE_COMPRESSION_MIN_SIZE
+    ):
+        return text
+    return compress_content(text) or text
+
+
+def decode_content(value: str | bytes) -> str:
+    """Return the JSON text of a stored value, compressed or not"""
+    if isinstance(value, str):
+        return value
+    if value.startswith(MARKER):
+        return zlib.decompress(value[len(MARKER) :]).decode()
+    return value.decode()
@@ -1,15 +1,51 @@
+import asyncio
 import sqlite3
-from contextlib import contextmanager
-from typing import Generator
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Generator, Iterable
 
+import aiosqlite
 from config import settings
+from utils.migrations import run_migrations
 
 DATABASE_URL = settings.DATABASE_URL
 
+# Applied to every connection. WAL lets readers proceed while a write is in
+# progress, and with WAL, synchronous=NORMAL only syncs at checkpoints
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    f"PRAGMA cache_size = -{settings.DATABASE_CACHE_SIZE}",
+)
+
+# Prepared statements kept per connection, keyed by SQL text
+CACHED_STATEMENTS = 256
+
+# A single write statement and its parameters
+Write = tuple[str, tuple]
+
+# Connections are kept open and reused, one per thread
+_local = threading.local()
+
+
+def connect() -> sqlite3.Connection:
+    """Open a new database connection with the standard pragmas applied"""
+    conn = sqlite3.connect(DATABASE_URL, cached_statements=CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 
 def init_db() -> None:
-    """Initialize the database and create tables if they don't exist"""
-    conn = sqlite3.connect(DATABASE_URL)
+    """Initialize the database, creating tables and applying migrations"""
+    with get_db() as conn:
+        _create_tables(conn)
+        run_migrations(conn)
+
+
+def _create_tables(conn: sqlite3.Connection) -> None:
     c = conn.cursor()
 
     c.execute(
@@ -56,29 +92,131 @@ def init_db() -> None:
     )
 
     conn.commit()
-    conn.close()
 
 
 @contextmanager
 def get_db() -> Generator[sqlite3.Connection, None, None]:
-    conn = sqlite3.connect(DATABASE_URL)
-    conn.row_factory = sqlite3.Row
+    """Get this thread's database connection, opening it on first use.
+
+    Anything left uncommitted when the block raises is rolled back, so a
+    failed statement never leaks into the next user of the connection.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect()
     try:
         yield conn
-    finally:
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+
+
+def close_db() -> None:
+    """Close this thread's database connection, if it has one"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
         conn.close()
 
 
-def execute_query(query: str, params: tuple = ()) -> list:
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        conn.commit()
-        return cursor.fetchall()
+class Database:
+    """Async database access on top of aiosqlite.
+
+    All writes go through a single connection guarded by a lock, so a
+    transaction has the connection to itself for its whole duration. Reads
+    are spread over a small pool of connections which, with WAL, never
+    wait for writers. Each connection runs on its own thread and keeps its
+    prepared statements cached, so repeated queries skip re-parsing.
+    """
+
+    def __init__(self, path: str, readers: int = settings.DATABASE_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._reader_pool: asyncio.Queue[aiosqlite.Connection] = (
+            asyncio.Queue()
+        )
+
+    async def connect(self) -> None:
+        """Open the writer and reader connections"""
+        self._writer = await self._connect()
+        for _ in range(self.readers):
+            self._reader_pool.put_nowait(await self._connect())
+
+    async def close(self) -> None:
+        """Close all connections"""
+        while not self._reader_pool.empty():
+            await self._reader_pool.get_nowait().close()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # Autocommit mode; transactions are opened explicitly
+        conn = await aiosqlite.connect(
+            self.path,
+            isolation_level=None,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    @asynccontextmanager
+    async def _reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._reader_pool.get()
+        try:
+            yield conn
+        finally:
+            self._reader_pool.put_nowait(conn)
+
+    async def fetch_all(
+        self, query: str, params: Iterable = ()
+    ) -> list[sqlite3.Row]:
+        """Run a read query and return all rows"""
+        async with self._reader() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchall()
+
+    async def fetch_one(
+        self, query: str, params: Iterable = ()
+    ) -> sqlite3.Row | None:
+        """Run a read query and return its first row, if any"""
+        async with self._reader() as conn:
+            async with conn.execute(query, params) as cursor:
+                return await cursor.fetchone()
+
+    async def execute(self, query: str, params: Iterable = ()) -> int:
+        """Run a single write statement; return the number of rows changed"""
+        async with self._write_lock:
+            async with self._writer.execute(query, params) as cursor:
+                return cursor.rowcount
+
+    async def execute_many(
+        self, query: str, params: Iterable[Iterable]
+    ) -> None:
+        """Run a write statement for each parameter set, in one transaction"""
+        async with self.transaction() as conn:
+            await conn.executemany(query, params)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Run the statements issued on the yielded connection atomically.
+
+        The write lock is held until the block exits, committing on success
+        and rolling back on error.
+        """
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.execute("ROLLBACK")
+                raise
+            await self._writer.execute("COMMIT")
 
 
-def execute_many(query: str, params: list[tuple]) -> None:
-    """Execute a query with multiple parameter sets"""
-    with get_db() as (conn, c):
-        c.executemany(query, params)
-        conn.commit()
+db = Database(DATABASE_URL)
@@ -0,0 +1,316 @@
+"""Conditional and byte-range responses for files on disk.
+
+`file_response` answers a GET or HEAD for a file, honouring:
+
+- `If-None-Match` and `If-Modified-Since`, with a 304 when the client's copy
+  is current
+- `Range` with a single byte range, with a 206 holding just those bytes, or
+  a 416 when the range is outside the file. `If-Range` limits this to
+  clients whose partial copy is still current
+- a strong ETag derived from the file's SHA-256 where it is known, so the
+  same bytes have the same ETag whichever path they are served from
+
+Requests for several ranges at once are answered with the whole file, as
+RFC 9110 allows.
+"""
+
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+import anyio
+from fastapi import Request
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Receive, Scope, Send
+
+_BYTE_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+
+# Headers repeated on 304 responses, per RFC 9110
+_NOT_MODIFIED_HEADERS = ("cache-control", "etag", "last-modified", "vary")
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a requested byte range lies outside the file."""
+
+
+def strong_etag(sha256: str) -> str:
+    """Strong ETag for content with the given SHA-256 hex digest"""
+    return f'"{sha256}"'
+
+
+def weak_etag(stat_result: os.stat_result) -> str:
+    """Weak ETag for a file whose content hash isn't known"""
+    return f'W/"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches `etag` (weak comparison)"""
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in header.split(",")
+    )
+
+
+def _modified_since(header: Optional[str], mtime: float) -> bool:
+    """False only if If-Modified-Since is a valid date no older than mtime"""
+    if header is None:
+        return True
+    try:
+        since = parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return True
+    return int(mtime) > since
+
+
+def _if_range_matches(
+    header: Optional[str], etag: str, last_modified: str
+) -> bool:
+    """Whether a Range request may be served given its If-Range header"""
+    if header is None:
+        return True
+    header = header.strip()
+    if header.startswith(('"', "W/")):
+        # Only a strong ETag can validate a partial response
+        return not etag.startswith("W/") and header == etag
+    return header == last_modified
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """Parse a Range header into a [start, end) byte range of a file.
+
+    Returns:
+        tuple[int, int]: The range to send, or None if the header should
+            be ignored and the whole file sent
+
+    Raises:
+        RangeNotSatisfiable: If the range starts beyond the end of the file
+    """
+    match = _BYTE_RANGE.fullmatch(header.strip().replace(" ", ""))
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+        if last and int(last) < start:
+            return None
+    elif last:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size
+        if int(last) == 0:
+            raise RangeNotSatisfiable()
+    else:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+class FileRangeResponse(FileResponse):
+    """A FileResponse that sends only the bytes [start, end) of the file"""
+
+    def __init__(
+        self,
+        path: str,
+        start: int,
+        end: int,
+        stat_result: os.stat_result,
+        **kwargs,
+    ) -> None:
+        super().__init__(
+            path, status_code=206, stat_result=stat_result, **kwargs
+        )
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start)
+        self.headers["content-range"] = (
+            f"bytes {start}-{end - 1}/{stat_result.st_size}"
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if not self.send_header_only:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(self.start)
+                remaining = self.end - self.start
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        # The file was truncated after it was looked up
+                        break
+                    remaining -= len(chunk)
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": True,
+                        }
+                    )
+        await send({"type": "http.response.body", "body": b""})
+        if self.background is not None:
+            await self.background()
+
+
+def file_response(
+    request_headers: Headers,
+    method: str,
+    path: str,
+    stat_result: os.stat_result,
+    etag: str,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    cache_control: Optional[str] = None,
+) -> Response:
+    """Respond to a GET or HEAD for a file, honouring conditional headers.
+
+    Args:
+        request_headers: The request's headers
+        method: The request method
+        path: Path of the file on disk
+        stat_result: The file's stat, taken when it was looked up
+        etag: The file's ETag, preferably from `strong_etag`
+        media_type: The file's content type, guessed from its name if None
+        filename: Name to offer the file under, as an attachment
+        cache_control: Value for the Cache-Control header, if any
+
+    Returns:
+        Response: A 304, 206 or 416 response where the headers call for
+            one, otherwise the whole file
+    """
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    headers = {
+        "etag": etag,
+        "last-modified": last_modified,
+        "accept-ranges": "bytes",
+    }
+    if cache_control:
+        headers["cache-control"] = cache_control
+
+    # If-Modified-Since is only consulted without If-None-Match
+    if_none_match = request_headers.get("if-none-match")
+    if (
+        etag_matches(if_none_match, etag)
+        if if_none_match is not None
+        else not _modified_since(
+            request_headers.get("if-modified-since"), stat_result.st_mtime
+        )
+    ):
+        return Response(
+            status_code=304,
+            headers={
+                name: value
+                for name, value in headers.items()
+                if name in _NOT_MODIFIED_HEADERS
+            },
+        )
+
+    range_header = request_headers.get("range")
+    if range_header and _if_range_matches(
+        request_headers.get("if-range"), etag, last_modified
+    ):
+        try:
+            byte_range = parse_range(range_header, stat_result.st_size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={
+                    **headers,
+                    "content-range": f"bytes */{stat_result.st_size}",
+                },
+            )
+        if byte_range is not None:
+            return FileRangeResponse(
+                path,
+                *byte_range,
+                stat_result=stat_result,
+                headers=headers,
+                media_type=media_type,
+                filename=filename,
+                method=method,
+            )
+
+    return FileResponse(
+        path,
+        stat_result=stat_result,
+        headers=headers,
+        media_type=media_type,
+        filename=filename,
+        method=method,
+    )
+
+
+async def send_file(
+    request: Request,
+    path: str,
+    etag: Optional[str] = None,
+    media_type: Optional[str] = None,
+    filename: Optional[str] = None,
+    cache_control: Optional[str] = None,
+) -> Optional[Response]:
+    """`file_response` for a route handler; None if the file doesn't exist.
+
+    Without an ETag, a weak one is derived from the file's stat.
+    """
+    try:
+        stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    except FileNotFoundError:
+        return None
+    return file_response(
+        request.headers,
+        request.method,
+        path,
+        stat_result,
+        etag or weak_etag(stat_result),
+        media_type=media_type,
+        filename=filename,
+        cache_control=cache_control,
+    )
+
+
+class RangeStaticFiles(StaticFiles):
+    """StaticFiles with Range requests and content-hash ETags.
+
+    Files named after the SHA-256 of their content, as uploads are, get a
+    strong ETag from the name and are cached as immutable; other files get
+    a weak ETag from their stat.
+    """
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        if status_code != 200:
+            return super().file_response(
+                full_path, stat_result, scope, status_code
+            )
+        stem = os.path.splitext(os.path.basename(full_path))[0]
+        if _SHA256.fullmatch(stem):
+            etag = strong_etag(stem)
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            etag, cache_control = weak_etag(stat_result), None
+        return file_response(
+            Headers(scope=scope),
+            scope["method"],
+            full_path,
+            stat_result,
+            etag,
+            cache_control=cache_control,
+        )
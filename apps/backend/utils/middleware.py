@@ -0,0 +1,53 @@
+from fastapi import HTTPException
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class MaxBodySizeMiddleware:
+    """Rejects request bodies over `max_size` bytes under a path prefix.
+
+    Requests declaring a larger Content-Length get a 413 before any of the
+    body is read. Otherwise the body is counted as the app reads it, and
+    reading past the limit raises a 413 HTTPException, so chunked bodies
+    without a length are cut off as soon as they go over.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int, path_prefix: str):
+        self.app = app
+        self.max_size = max_size
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(
+            self.path_prefix
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if (
+            content_length is not None
+            and content_length.isdigit()
+            and int(content_length) > self.max_size
+        ):
+            response = JSONResponse(
+                {"detail": "Request body too large"}, status_code=413
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    raise HTTPException(
+                        status_code=413, detail="Request body too large"
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
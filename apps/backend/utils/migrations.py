@@ -0,0 +1,454 @@
+"""Versioned schema migrations.
+
+Migrations run in order on startup, after the base tables are created. Each
+one runs in its own transaction and records its version in the
+`schema_version` table, so it is applied exactly once per database. New
+migrations are appended to `MIGRATIONS` with the next version number;
+released migrations are never edited.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable
+
+from utils.blobs import blob_hashes, extract_blobs
+from utils.compression import decode_content
+from utils.search import message_text
+from utils.uploads import UPLOAD_DIR, hash_file, upload_path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class Migration:
+    version: int
+    description: str
+    statements: tuple[str, ...] = ()
+    # For data migrations that need more than plain SQL; runs after
+    # `statements`, inside the same transaction
+    apply: Callable[[sqlite3.Connection], None] | None = None
+
+
+def _move_inline_images_to_blobs(conn: sqlite3.Connection) -> None:
+    ids = [
+        row[0]
+        for row in conn.execute(
+            "SELECT id FROM messages WHERE content LIKE '%\"base64\"%'"
+        )
+    ]
+    now = datetime.utcnow()
+    for msg_id in ids:
+        (content_json,) = conn.execute(
+            "SELECT content FROM messages WHERE id = ?", (msg_id,)
+        ).fetchone()
+        content = json.loads(content_json)
+        if not isinstance(content, list):
+            continue
+        content, blobs = extract_blobs(content)
+        if not blobs:
+            continue
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO blobs (hash, media_type, size, data, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (digest, media_type, len(data), data, now)
+                for digest, (media_type, data) in blobs.items()
+            ],
+        )
+        conn.execute(
+            "UPDATE messages SET content = ? WHERE id = ?",
+            (json.dumps(content), msg_id),
+        )
+
+
+def _index_message_text(conn: sqlite3.Connection) -> None:
+    for msg_id, content in conn.execute("SELECT id, content FROM messages"):
+        content = json.loads(decode_content(content))
+        if not isinstance(content, list):
+            continue
+        conn.execute(
+            "INSERT INTO messages_fts (text, message_id) VALUES (?, ?)",
+            (message_text(content), msg_id),
+        )
+        conn.execute(
+            "UPDATE messages SET fts_rowid = last_insert_rowid() WHERE id = ?",
+            (msg_id,),
+        )
+
+
+def _record_blob_references(conn: sqlite3.Connection) -> None:
+    for msg_id, content in conn.execute(
+        "SELECT id, content FROM messages WHERE content LIKE '%\"blob\"%' "
+        "OR typeof(content) = 'blob'"
+    ):
+        content = json.loads(decode_content(content))
+        if not isinstance(content, list):
+            continue
+        conn.executemany(
+            "INSERT OR IGNORE INTO message_blobs (message_id, hash) "
+            "VALUES (?, ?)",
+            [(msg_id, digest) for digest in blob_hashes(content)],
+        )
+
+
+def _store_uploads_by_hash(conn: sqlite3.Connection) -> None:
+    # Moves are undone if the migration fails; duplicates are only removed
+    # once every file has been moved
+    moved: list[tuple[str, str]] = []
+    duplicates: list[str] = []
+    now = datetime.utcnow()
+    try:
+        rows = conn.execute("SELECT id, path FROM files").fetchall()
+        for file_id, path in rows:
+            old_path = os.path.join(UPLOAD_DIR, path)
+            if not os.path.isfile(old_path):
+                continue
+            sha256 = hash_file(old_path)
+            size = os.path.getsize(old_path)
+            row = conn.execute(
+                "SELECT path FROM upload_blobs WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+            if row is not None:
+                new_path = row[0]
+                if new_path != path:
+                    duplicates.append(old_path)
+            else:
+                new_path = upload_path(sha256, os.path.splitext(path)[1])
+                if new_path != path:
+                    full_path = os.path.join(UPLOAD_DIR, new_path)
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(old_path, full_path)
+                    moved.append((old_path, full_path))
+                conn.execute(
+                    """
+                    INSERT INTO upload_blobs
+                        (sha256, path, size, refcount, created_at)
+                    VALUES (?, ?, ?, 0, ?)
+                    """,
+                    (sha256, new_path, size, now),
+                )
+            conn.execute(
+                "UPDATE files SET path = ?, sha256 = ? WHERE id = ?",
+                (new_path, sha256, file_id),
+            )
+        conn.execute(
+            """
+            UPDATE upload_blobs SET refcount = (
+                SELECT COUNT(*) FROM files
+                WHERE files.sha256 = upload_blobs.sha256
+            )
+            """
+        )
+    except BaseException:
+        for old_path, full_path in reversed(moved):
+            os.replace(full_path, old_path)
+        raise
+    for path in duplicates:
+        os.remove(path)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        version=1,
+        description="Index messages by session and creation time",
+        statements=(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_session_created
+            ON messages (session_id, created_at)
+            """,
+        ),
+    ),
+    Migration(
+        version=2,
+        description="Index files by session",
+        statements=(
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_session
+            ON files (session_id)
+            """,
+        ),
+    ),
+    Migration(
+        version=3,
+        description="Add message id to the session message index for "
+        "cursor pagination",
+        statements=(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_session_created_id
+            ON messages (session_id, created_at, id)
+            """,
+            "DROP INDEX IF EXISTS idx_messages_session_created",
+        ),
+    ),
+    Migration(
+        version=4,
+        description="Move inline images from message content to a "
+        "content-addressed blob store",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY,  -- SHA-256 of data, hex
+                media_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+            """,
+        ),
+        apply=_move_inline_images_to_blobs,
+    ),
+    Migration(
+        version=5,
+        description="Add a full-text search index over message text",
+        statements=(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+                text,
+                message_id UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """,
+            # Message rowids aren't stable across VACUUM, so messages keep
+            # the rowid of their index entry instead
+            "ALTER TABLE messages ADD COLUMN fts_rowid INTEGER",
+            """
+            CREATE TRIGGER IF NOT EXISTS messages_fts_delete
+            AFTER DELETE ON messages
+            BEGIN
+                DELETE FROM messages_fts WHERE rowid = old.fts_rowid;
+            END
+            """,
+        ),
+        apply=_index_message_text,
+    ),
+    Migration(
+        version=6,
+        description="Add message summary columns to sessions",
+        statements=(
+            """
+            ALTER TABLE sessions
+            ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0
+            """,
+            "ALTER TABLE sessions ADD COLUMN last_message_at TIMESTAMP",
+            # Last message time, or creation time for sessions without
+            # messages, in the ISO format messages use so it sorts correctly
+            "ALTER TABLE sessions ADD COLUMN last_active_at TIMESTAMP",
+            """
+            ALTER TABLE sessions
+            ADD COLUMN input_tokens INTEGER NOT NULL DEFAULT 0
+            """,
+            """
+            ALTER TABLE sessions
+            ADD COLUMN output_tokens INTEGER NOT NULL DEFAULT 0
+            """,
+            """
+            ALTER TABLE sessions
+            ADD COLUMN stored_bytes INTEGER NOT NULL DEFAULT 0
+            """,
+            """
+            UPDATE sessions SET
+                message_count = stats.message_count,
+                last_message_at = stats.last_message_at,
+                stored_bytes = stats.stored_bytes
+            FROM (
+                SELECT
+                    session_id,
+                    count(*) AS message_count,
+                    max(created_at) AS last_message_at,
+                    sum(length(CAST(content AS BLOB))) AS stored_bytes
+                FROM messages
+                GROUP BY session_id
+            ) AS stats
+            WHERE sessions.id = stats.session_id
+            """,
+            """
+            UPDATE sessions SET last_active_at = coalesce(
+                last_message_at, replace(created_at, ' ', 'T')
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_active
+            ON sessions (last_active_at, id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_status_active
+            ON sessions (status, last_active_at, id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_created
+            ON sessions (created_at, id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_status_created
+            ON sessions (status, created_at, id)
+            """,
+        ),
+    ),
+    Migration(
+        version=7,
+        description="Track sessions whose messages are archived",
+        statements=(
+            "ALTER TABLE sessions ADD COLUMN archived_at TIMESTAMP",
+            # Finds idle sessions without scanning those already archived
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_unarchived_active
+            ON sessions (last_active_at)
+            WHERE archived_at IS NULL
+            """,
+        ),
+    ),
+    Migration(
+        version=8,
+        description="Record which messages reference each blob",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS message_blobs (
+                message_id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (message_id, hash),
+                FOREIGN KEY (message_id) REFERENCES messages (id)
+                    ON DELETE CASCADE
+            ) WITHOUT ROWID
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_message_blobs_hash
+            ON message_blobs (hash)
+            """,
+        ),
+        apply=_record_blob_references,
+    ),
+    Migration(
+        version=9,
+        description="Record the SHA-256 of uploaded files",
+        statements=("ALTER TABLE files ADD COLUMN sha256 TEXT",),
+    ),
+    Migration(
+        version=10,
+        description="Store uploads once per content hash",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS upload_blobs (
+                sha256 TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL,
+                created_at TIMESTAMP NOT NULL
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS files_upload_blob_insert
+            AFTER INSERT ON files WHEN new.sha256 IS NOT NULL
+            BEGIN
+                UPDATE upload_blobs SET refcount = refcount + 1
+                WHERE sha256 = new.sha256;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS files_upload_blob_delete
+            AFTER DELETE ON files WHEN old.sha256 IS NOT NULL
+            BEGIN
+                UPDATE upload_blobs SET refcount = refcount - 1
+                WHERE sha256 = old.sha256;
+            END
+            """,
+        ),
+        apply=_store_uploads_by_hash,
+    ),
+    Migration(
+        version=11,
+        description="Track resumable uploads",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                mime_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT,
+                received TEXT NOT NULL DEFAULT '[]',
+                received_bytes INTEGER NOT NULL DEFAULT 0,
+                session_id TEXT NOT NULL,
+                created_at TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP NOT NULL,
+                FOREIGN KEY (session_id) REFERENCES sessions (id)
+                    ON DELETE CASCADE
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_uploads_session
+            ON uploads (session_id)
+            """,
+        ),
+    ),
+    Migration(
+        version=12,
+        description="Track restored sessions and page idle sessions by id",
+        statements=(
+            "ALTER TABLE sessions ADD COLUMN restored_at TEXT",
+            "DROP INDEX IF EXISTS idx_sessions_unarchived_active",
+            """
+            CREATE INDEX IF NOT EXISTS idx_sessions_unarchived_active
+            ON sessions (last_active_at, id)
+            WHERE archived_at IS NULL
+            """,
+        ),
+    ),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Return the version of the last migration applied to the database"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL
+        )
+    """
+    )
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(
+    conn: sqlite3.Connection, migrations: list[Migration] = MIGRATIONS
+) -> int:
+    """Apply all pending migrations in order; return the schema version"""
+    version = get_schema_version(conn)
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+
+        logger.info(
+            f"Applying migration {migration.version}: {migration.description}"
+        )
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for statement in migration.statements:
+                conn.execute(statement)
+            if migration.apply is not None:
+                migration.apply(conn)
+            conn.execute(
+                """
+                INSERT INTO schema_version (version, description, applied_at)
+                VALUES (?, ?, ?)
+                """,
+                (migration.version, migration.description, datetime.utcnow()),
+            )
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        version = migration.version
+
+    return version
@@ -0,0 +1,78 @@
+"""Rendering previews of uploaded files.
+
+Images get a thumbnail no larger than a square of a given size, saved as
+WebP. Text files get their first few lines as UTF-8 text. Anything else
+has no preview.
+"""
+
+import os
+import tempfile
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+THUMBNAIL_MEDIA_TYPE = "image/webp"
+TEXT_MEDIA_TYPE = "text/plain"
+
+# Lines kept in a text preview
+TEXT_PREVIEW_LINES = 40
+
+
+def _write_atomically(path: str, write) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def render_thumbnail(src: str, dest: str, size: int) -> bool:
+    """Write a WebP thumbnail of the image at `src` to `dest`.
+
+    Returns:
+        bool: False if `src` isn't an image Pillow can read
+    """
+    try:
+        with Image.open(src) as image:
+            # Lets JPEGs be decoded at a fraction of their full size
+            image.draft("RGB", (size, size))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert(
+                    "RGBA" if "transparency" in image.info else "RGB"
+                )
+            _write_atomically(
+                dest, lambda f: image.save(f, "WEBP", quality=80)
+            )
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return False
+    return True
+
+
+def render_text_head(src: str, dest: str, max_bytes: int) -> bool:
+    """Write the first lines of the text file at `src` to `dest`.
+
+    At most `max_bytes` bytes and TEXT_PREVIEW_LINES lines are kept.
+
+    Returns:
+        bool: False if `src` doesn't look like UTF-8 text
+    """
+    with open(src, "rb") as f:
+        head = f.read(max_bytes)
+    if b"\0" in head:
+        return False
+    try:
+        text = head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # Allow a character cut off by the byte limit, but nothing else
+        if e.start < len(head) - 3:
+            return False
+        text = head[: e.start].decode("utf-8")
+    lines = text.splitlines(keepends=True)[:TEXT_PREVIEW_LINES]
+    _write_atomically(dest, lambda f: f.write("".join(lines).encode()))
+    return True
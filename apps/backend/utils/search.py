@@ -0,0 +1,66 @@
+"""Full-text search over message content.
+
+Each message's searchable text is kept in the `messages_fts` FTS5 table,
+along with the message's ID. It is written on the save path, since content
+is stored compressed. The index entry is inserted first, and the message
+row then stores the entry's rowid in `messages.fts_rowid`, taken from
+`last_insert_rowid()` in the same transaction. Message rowids aren't
+stable across VACUUM, so the trigger that removes the entry when its
+message is deleted looks it up by `fts_rowid`.
+"""
+
+import re
+from typing import Any
+
+# Longest text indexed per message; the rest of long tool output is dropped
+MAX_INDEXED_CHARS = 64 * 1024
+
+
+def _strings(value: Any) -> list[str]:
+    """All strings nested in a tool input, in order"""
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        return [s for item in value for s in _strings(item)]
+    return []
+
+
+def message_text(content: list[dict[str, Any]]) -> str:
+    """Extract the searchable text of a message's content blocks.
+
+    Covers text blocks, the string values of tool_use inputs and the text
+    of tool results. Thinking blocks and images are not indexed.
+    """
+    parts: list[str] = []
+    for block in content:
+        if not isinstance(block, dict):
+            continue
+        if block.get("type") == "text":
+            parts.append(block.get("text", ""))
+        elif block.get("type") == "tool_use":
+            parts.extend(_strings(block.get("input")))
+        elif block.get("type") == "tool_result":
+            result = block.get("content")
+            if isinstance(result, str):
+                parts.append(result)
+            elif isinstance(result, list):
+                parts.extend(
+                    b.get("text", "")
+                    for b in result
+                    if isinstance(b, dict) and b.get("type") == "text"
+                )
+    return "\n".join(part for part in parts if part)[:MAX_INDEXED_CHARS]
+
+
+def match_query(query: str) -> str | None:
+    """Turn free text into an FTS5 query matching all of its words.
+
+    Words are quoted so FTS5 operators and punctuation in the input are
+    taken literally. Returns None if the input has no words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words)
@@ -0,0 +1,38 @@
+"""Background tasks run alongside the app.
+
+Tasks started here are kept referenced until they finish, their failures
+are logged, and whatever is still running is cancelled on shutdown.
+"""
+
+import asyncio
+import logging
+from typing import Coroutine
+
+logger = logging.getLogger(__name__)
+
+_tasks: set[asyncio.Task] = set()
+
+
+def _task_done(task: asyncio.Task) -> None:
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            f"Background task {task.get_name()} failed",
+            exc_info=task.exception(),
+        )
+
+
+def start_background_task(coro: Coroutine, name: str) -> asyncio.Task:
+    """Run a coroutine in the background, logging it if it fails"""
+    task = asyncio.create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+async def stop_background_tasks() -> None:
+    """Cancel all running background tasks and wait for them to finish"""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
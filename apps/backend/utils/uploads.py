@@ -0,0 +1,49 @@
+"""Content-addressed storage of uploaded files.
+
+Each distinct upload is stored once under `UPLOAD_DIR`, at a path derived
+from the SHA-256 of its bytes, and recorded in the `upload_blobs` table with
+the number of `files` rows that point at it:
+
+    <UPLOAD_DIR>/ab/ab12...ef.csv
+
+The extension of the first upload with those bytes is kept, so the file is
+still served with a sensible type. Triggers on `files` keep `refcount` up to
+date, and a stored file is removed once nothing references it.
+
+Resumable uploads are assembled in `INCOMING_DIR` until they are complete.
+"""
+
+import hashlib
+import os
+
+from config import settings
+
+UPLOAD_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), settings.UPLOAD_DIR
+)
+
+# Partial files of resumable uploads, one per upload
+INCOMING_DIR = os.path.join(UPLOAD_DIR, ".incoming")
+
+# Bytes read at a time when hashing a file on disk
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def upload_path(sha256: str, ext: str) -> str:
+    """Path, relative to UPLOAD_DIR, where an upload's bytes are stored"""
+    ext = ext.lower() if ext[1:].isalnum() else ""
+    return os.path.join(sha256[:2], f"{sha256}{ext}")
+
+
+def incoming_path(upload_id: str) -> str:
+    """Path of the partial file a resumable upload is assembled in"""
+    return os.path.join(INCOMING_DIR, f"{upload_id}.part")
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 hex digest of a file's contents"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
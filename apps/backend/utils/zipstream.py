@@ -0,0 +1,106 @@
+"""Zip archives built on the fly, for streaming to a client.
+
+The archive is written to a sink that only buffers what has been written
+since it was last drained, and file contents are read a chunk at a time,
+so memory use stays constant however large the files are. As the output
+can't be seeked, each entry's sizes and CRC follow its data in a data
+descriptor, which every common unzip tool understands.
+"""
+
+import os
+import re
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple
+
+# Bytes read from a file at a time
+ZIP_CHUNK_SIZE = 256 * 1024
+
+_DRIVE = re.compile(r"^[A-Za-z]:")
+
+
+class ZipEntry(NamedTuple):
+    name: str  # Name within the archive
+    path: str  # Path of the file on disk
+    modified_at: datetime
+
+
+class _Sink:
+    """A write-only file object whose contents are drained as they arrive"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self._chunks = self._chunks, []
+        if chunks:
+            yield b"".join(chunks)
+
+
+def safe_name(name: str, default: str = "file") -> str:
+    """Reduce a file name to one that unzips inside the target directory.
+
+    Only the last path component is kept, with either slash counting as a
+    separator, and a drive letter is dropped. Names left empty, or that are
+    `.` or `..`, become `default`.
+    """
+    name = name.replace("\\", "/").rsplit("/", 1)[-1]
+    name = _DRIVE.sub("", name).replace("\0", "").strip()
+    return default if name in ("", ".", "..") else name
+
+
+def unique_names(names: Iterable[str]) -> Iterator[str]:
+    """Rename repeated names to "name (2).ext", "name (3).ext" and so on"""
+    seen: set[str] = set()
+    for name in names:
+        base, ext = os.path.splitext(name)
+        candidate, n = name, 1
+        while candidate in seen:
+            n += 1
+            candidate = f"{base} ({n}){ext}"
+        seen.add(candidate)
+        yield candidate
+
+
+def stream_zip(
+    entries: Iterable[ZipEntry], compress: bool = True
+) -> Iterator[bytes]:
+    """Yield a zip archive of `entries` in chunks.
+
+    Files are read lazily as the archive is consumed. Entries whose file
+    is gone by the time they are reached are left out.
+
+    Args:
+        entries: The files to include, in order
+        compress: Deflate the files; otherwise they are stored as they are
+    """
+    sink = _Sink()
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, "w", compression, allowZip64=True) as zf:
+        for entry in entries:
+            try:
+                src = open(entry.path, "rb")
+            except FileNotFoundError:
+                continue
+            with src:
+                info = zipfile.ZipInfo(
+                    entry.name,
+                    date_time=max(entry.modified_at, datetime(1980, 1, 1))
+                    .timetuple()[:6],
+                )
+                info.compress_type = compression
+                # Lets zipfile decide up front whether it needs Zip64
+                info.file_size = os.fstat(src.fileno()).st_size
+                with zf.open(info, "w") as dst:
+                    while chunk := src.read(ZIP_CHUNK_SIZE):
+                        dst.write(chunk)
+                        yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()